@@ -0,0 +1,105 @@
+import collections
+import time
+
+
+class TokenBucket:
+    __slots__ = ('rate', 'burst', 'tokens', 'updated', 'told_until')
+
+    def __init__(self, rate: float, burst: float, now: float):
+        self.rate = rate
+        self.burst = burst
+        self.tokens = burst
+        self.updated = now
+        # Refusals before this time aren't answered again.
+        self.told_until = 0.0
+
+    def wait(self, now: float):
+        """Seconds until a token is available; 0.0 if one is."""
+        self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+        return 0.0 if self.tokens >= 1 else (1 - self.tokens) / self.rate
+
+
+class Refusal:
+    __slots__ = ('reason', 'retry_after', 'notify')
+
+    def __init__(self, reason: str, retry_after: float, notify: bool):
+        self.reason = reason
+        self.retry_after = retry_after
+        # False when the user was already told about an earlier refusal.
+        self.notify = notify
+
+
+class AdmissionController:
+    """Decides whether a request may start any work, before it does.
+
+    Every user and every guild has a token bucket refilling at `rate`
+    requests per second up to `burst`; a request takes a token from both,
+    or from neither when one is empty. Guild queues are capped at
+    `max_queue` tracks, and while `delay()` (how long the oldest waiting
+    extraction has waited) is over `max_delay`, new requests are shed so
+    the backlog can drain.
+    """
+
+    def __init__(self, *, user_rate: float, user_burst: float, guild_rate: float, guild_burst: float,
+                 max_queue: int, max_delay: float, delay=None, maxsize: int = 10000):
+        self.user_rate = user_rate
+        self.user_burst = user_burst
+        self.guild_rate = guild_rate
+        self.guild_burst = guild_burst
+        self.max_queue = max_queue
+        self.max_delay = max_delay
+        self.delay = delay
+        self.maxsize = maxsize
+
+        self._users = collections.OrderedDict()
+        self._guilds = collections.OrderedDict()
+
+        self.admitted = 0
+        self.refused = collections.Counter()
+
+    def _bucket(self, buckets: collections.OrderedDict, key: int, rate: float, burst: float, now: float):
+        bucket = buckets.get(key)
+        if bucket is None:
+            # The least recently used bucket has most likely refilled anyway.
+            if len(buckets) >= self.maxsize:
+                buckets.popitem(last=False)
+            bucket = buckets[key] = TokenBucket(rate, burst, now)
+        else:
+            buckets.move_to_end(key)
+
+        return bucket
+
+    def admit(self, user_id: int, guild_id: int, *, queued: int = 0):
+        """Returns None if the request may go ahead, else a `Refusal`."""
+        now = time.monotonic()
+        user = self._bucket(self._users, user_id, self.user_rate, self.user_burst, now)
+
+        if queued >= self.max_queue:
+            return self._refuse('queue', 0.0, user, now)
+
+        delay = self.delay() if self.delay is not None else 0.0
+        if delay > self.max_delay:
+            return self._refuse('overload', delay - self.max_delay, user, now)
+
+        guild = self._bucket(self._guilds, guild_id, self.guild_rate, self.guild_burst, now)
+        user_wait, guild_wait = user.wait(now), guild.wait(now)
+        if user_wait or guild_wait:
+            return self._refuse('user' if user_wait >= guild_wait else 'guild', max(user_wait, guild_wait), user, now)
+
+        user.tokens -= 1
+        guild.tokens -= 1
+        self.admitted += 1
+
+        return None
+
+    def _refuse(self, reason: str, retry_after: float, user: TokenBucket, now: float):
+        self.refused[reason] += 1
+        notify = now >= user.told_until
+        if notify:
+            user.told_until = now + max(retry_after, 5.0)
+
+        return Refusal(reason, retry_after, notify)
+
+    def stats(self):
+        return dict(self.refused, admitted=self.admitted, users=len(self._users), guilds=len(self._guilds))
@@ -0,0 +1,194 @@
+import asyncio
+import collections
+import hashlib
+import mmap
+import os
+
+import discord
+from discord.oggparse import OggStream
+
+
+class MmapOpusAudio(discord.AudioSource):
+    """Plays an Ogg/Opus file by reading its packets straight out of a memory
+    map; no FFmpeg process is involved."""
+
+    OPUS_HEADERS = (b'OpusHead', b'OpusTags')
+
+    def __init__(self, path: str, *, position: float = 0.0):
+        self._file = open(path, 'rb')
+        self._map = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ)
+        self._packets = OggStream(self._map).iter_packets()
+
+        skip = int(position * 1000 / discord.opus.Encoder.FRAME_LENGTH)
+        for _ in range(skip):
+            if not self.read():
+                break
+
+    def read(self):
+        for packet in self._packets:
+            if not packet.startswith(self.OPUS_HEADERS):
+                return packet
+
+        return b''
+
+    def is_opus(self):
+        return True
+
+    def cleanup(self):
+        self._packets = iter(())
+        if self._map is not None:
+            self._map.close()
+            self._file.close()
+            self._map = None
+
+
+class AudioCache:
+    """Content-addressed cache of pre-encoded Opus files keyed by video id.
+
+    A track is only admitted once it has been played `admit_after` times;
+    the oldest-used files are evicted once the cache grows past `max_bytes`.
+    The directory must not be shared with another process.
+    """
+
+    def __init__(self, directory: str, *, max_bytes: int = 2 * 1024 ** 3, admit_after: int = 3,
+                 max_duration: int = 20 * 60, bitrate: int = 128, workers: int = 2):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.admit_after = admit_after
+        self.max_duration = max_duration
+        self.bitrate = bitrate
+
+        self._files = collections.OrderedDict()
+        self._size = 0
+        self._plays = collections.OrderedDict()
+        self._filling = {}
+        self._semaphore = asyncio.Semaphore(workers)
+
+        self.hits = 0
+        self.misses = 0
+        self.admissions = 0
+        self.evictions = 0
+        self.failures = 0
+
+        os.makedirs(directory, exist_ok=True)
+        self._scan()
+
+    def _scan(self):
+        files = []
+        for entry in os.scandir(self.directory):
+            if entry.name.endswith('.opus'):
+                stat = entry.stat()
+                files.append((stat.st_mtime, entry.name[:-5], stat.st_size))
+            elif entry.name.endswith('.part'):
+                # Left behind by a previous run; the directory is ours alone.
+                os.unlink(entry.path)
+
+        for _, key, size in sorted(files):
+            self._files[key] = size
+            self._size += size
+
+    @staticmethod
+    def _key(video_id: str):
+        return hashlib.sha1(video_id.encode()).hexdigest()
+
+    def _path(self, key: str):
+        return os.path.join(self.directory, key + '.opus')
+
+    def lookup(self, video_id: str):
+        key = self._key(video_id)
+        if key not in self._files:
+            self.misses += 1
+            return None
+
+        self.hits += 1
+        self._files.move_to_end(key)
+        path = self._path(key)
+        try:
+            os.utime(path)
+        except FileNotFoundError:
+            self._size -= self._files.pop(key)
+            return None
+
+        return path
+
+    def record_play(self, video_id: str, info: dict):
+        """Counts a play of a network stream and starts caching it in the
+        background once it has been played often enough."""
+        if not video_id or not info.get('url'):
+            return
+
+        key = self._key(video_id)
+        plays = self._plays.pop(key, 0) + 1
+        self._plays[key] = plays
+        while len(self._plays) > 10000:
+            self._plays.popitem(last=False)
+
+        if (plays < self.admit_after or key in self._files or key in self._filling
+                or int(info.get('duration') or 0) > self.max_duration):
+            return
+
+        self._filling[key] = asyncio.ensure_future(self._fill(key, info))
+
+    async def _fill(self, key: str, info: dict):
+        path = self._path(key)
+        part = path + '.part'
+        if info.get('acodec') == 'opus':
+            codec = ['-c:a', 'copy']
+        else:
+            codec = ['-c:a', 'libopus', '-b:a', '{}k'.format(self.bitrate), '-ar', '48000', '-ac', '2']
+
+        try:
+            async with self._semaphore:
+                process = await asyncio.create_subprocess_exec(
+                    'ffmpeg', '-loglevel', 'error', '-y',
+                    '-reconnect', '1', '-reconnect_streamed', '1', '-reconnect_delay_max', '5',
+                    '-i', info['url'], '-vn', '-map_metadata', '-1', *codec, '-f', 'opus', part,
+                    stdin=asyncio.subprocess.DEVNULL, stdout=asyncio.subprocess.DEVNULL,
+                    stderr=asyncio.subprocess.DEVNULL)
+                try:
+                    returncode = await process.wait()
+                except asyncio.CancelledError:
+                    process.kill()
+                    raise
+
+            if returncode != 0:
+                self.failures += 1
+                return
+
+            os.replace(part, path)
+            self._files[key] = os.path.getsize(path)
+            self._size += self._files[key]
+            self.admissions += 1
+            self._evict()
+        except OSError:
+            self.failures += 1
+        finally:
+            self._filling.pop(key, None)
+            if os.path.exists(part):
+                os.unlink(part)
+
+    def _evict(self):
+        while self._size > self.max_bytes and len(self._files) > 1:
+            key, size = self._files.popitem(last=False)
+            self._size -= size
+            self.evictions += 1
+            try:
+                os.unlink(self._path(key))
+            except FileNotFoundError:
+                pass
+
+    def stats(self):
+        return {
+            'files': len(self._files),
+            'bytes': self._size,
+            'filling': len(self._filling),
+            'hits': self.hits,
+            'misses': self.misses,
+            'admissions': self.admissions,
+            'evictions': self.evictions,
+            'failures': self.failures,
+        }
+
+    def close(self):
+        for task in list(self._filling.values()):
+            task.cancel()
@@ -0,0 +1,114 @@
+"""CPU cost per stream for each YTDLSource playback mode.
+
+Reads a local file through every mode as fast as possible and reports the
+CPU time spent (in this process and in FFmpeg) per second of audio, which is
+the fraction of a core one real-time stream costs.
+
+    python -m bench.audio [path] [--seconds 60]
+
+Without a path a test tone is generated with FFmpeg first. A second table
+compares the format picked for a 64 kbps voice channel (Opus, passed
+through) against the best format on offer (AAC, transcoded), both at 100%
+volume.
+"""
+import argparse
+import os
+import resource
+import subprocess
+import tempfile
+import time
+
+import discord
+
+from main import YTDLSource
+
+
+MODES = (
+    ('pcm', 0.5),
+    ('opus', 0.5),
+    ('opus', 1.0),
+)
+
+
+def generate_tone(directory: str, seconds: int, *, codec: str = 'libopus', bitrate: int = 128,
+                  name: str = 'tone.webm'):
+    path = os.path.join(directory, name)
+    subprocess.run(['ffmpeg', '-loglevel', 'error', '-f', 'lavfi', '-i',
+                    'sine=frequency=440:duration={}'.format(seconds), '-ac', '2', '-ar', '48000',
+                    '-c:a', codec, '-b:a', '{}k'.format(bitrate), path], check=True)
+    return path
+
+
+def children_cpu():
+    usage = resource.getrusage(resource.RUSAGE_CHILDREN)
+    return usage.ru_utime + usage.ru_stime
+
+
+def run(path: str, mode: str, volume: float, *, data: dict = None, bitrate: int = None):
+    YTDLSource.FFMPEG_OPTIONS = {'before_options': '', 'options': '-vn'}
+    data = data or {'url': path, 'acodec': 'opus', 'upload_date': '19700101', 'duration': 0}
+    source = YTDLSource(data=data, volume=volume, mode=mode, bitrate=bitrate)
+    encoder = None if source.is_opus() else discord.opus.Encoder()
+
+    frames = 0
+    cpu, child_cpu, wall = time.process_time(), children_cpu(), time.perf_counter()
+    while True:
+        frame = source.read()
+        if not frame:
+            break
+        if encoder is not None:
+            encoder.encode(frame, encoder.SAMPLES_PER_FRAME)
+        frames += 1
+    source.cleanup()
+
+    audio = frames * discord.opus.Encoder.FRAME_LENGTH / 1000
+    return {
+        'codec': source.codec,
+        'kbps': os.path.getsize(source.stream_url) * 8 / 1000 / audio if audio else 0.0,
+        'audio': audio,
+        'wall': time.perf_counter() - wall,
+        'python': time.process_time() - cpu,
+        'ffmpeg': children_cpu() - child_cpu,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('path', nargs='?')
+    parser.add_argument('--seconds', type=int, default=60)
+    args = parser.parse_args()
+
+    if not discord.opus.is_loaded():
+        discord.opus._load_default()
+
+    with tempfile.TemporaryDirectory() as directory:
+        path = args.path or generate_tone(directory, args.seconds)
+
+        print('{:<6} {:>6} {:>9} {:>9} {:>9} {:>10}'.format(
+            'mode', 'volume', 'python s', 'ffmpeg s', 'wall s', 'core/strm'))
+        for mode, volume in MODES:
+            result = run(path, mode, volume)
+            per_stream = (result['python'] + result['ffmpeg']) / result['audio']
+            print('{:<6} {:>6.2f} {:>9.3f} {:>9.3f} {:>9.3f} {:>9.2%}'.format(
+                mode, volume, result['python'], result['ffmpeg'], result['wall'], per_stream))
+
+        formats = [
+            {'format_id': '250', 'abr': 64.0, 'acodec': 'opus',
+             'url': generate_tone(directory, args.seconds, bitrate=64, name='250.webm')},
+            {'format_id': '140', 'abr': 128.0, 'acodec': 'mp4a.40.2',
+             'url': generate_tone(directory, args.seconds, codec='aac', bitrate=128, name='140.m4a')},
+        ]
+        data = {'url': formats[1]['url'], 'acodec': 'mp4a.40.2', 'upload_date': '19700101', 'duration': 0,
+                'audio_formats': formats}
+
+        print()
+        print('{:<9} {:<10} {:>6} {:>9} {:>10}'.format('format', 'codec', 'kbps', 'ffmpeg s', 'core/strm'))
+        for label, bitrate in (('best', None), ('64 kbps', 64)):
+            result = run(None, 'opus', 1.0, data=data, bitrate=bitrate)
+            per_stream = (result['python'] + result['ffmpeg']) / result['audio']
+            print('{:<9} {:<10} {:>6.0f} {:>9.3f} {:>9.2%}'.format(
+                label, result['codec'], result['kbps'], result['ffmpeg'], per_stream))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,328 @@
+"""Local stand-ins for Discord and YouTube used by the load benchmark.
+
+None of these talk to the network: the gateway hands fake messages straight
+to the bot's `on_message`, voice clients pull frames from their source on a
+thread like discord.py's AudioPlayer, and the extractor replays canned info
+dicts after a configurable delay.
+"""
+import itertools
+import threading
+import time
+import zlib
+
+import discord
+from discord.ext import commands
+
+
+OPUS_SILENCE = b'\xf8\xff\xfe'
+
+_ids = itertools.count(10 ** 17)
+
+
+def canned_infos(count: int, stream_url: str, *, duration: int = 180, codec: str = 'opus'):
+    infos = []
+    for i in range(count):
+        video_id = 'bench{:06d}'.format(i)
+        infos.append({
+            'id': video_id,
+            'title': 'Benchmark track {}'.format(i),
+            'uploader': 'Benchmark',
+            'uploader_url': 'https://www.youtube.com/channel/bench',
+            'upload_date': '20210101',
+            'thumbnail': 'https://i.ytimg.com/vi/{}/hqdefault.jpg'.format(video_id),
+            'description': '',
+            'duration': duration,
+            'tags': [],
+            'webpage_url': 'https://www.youtube.com/watch?v={}'.format(video_id),
+            'view_count': i,
+            'like_count': 0,
+            'dislike_count': 0,
+            'url': stream_url,
+            'acodec': codec,
+        })
+
+    return infos
+
+
+class FakeYoutubeDL:
+    """Answers `extract_info` from a fixed catalogue, blocking like the real one.
+
+    Searches pick a catalogue entry from a hash of the query, watch URLs
+    return their entry and any `list=` URL is a playlist cycling through the
+    catalogue.
+    """
+
+    def __init__(self, infos: list, *, search_latency: float = 0.2, extract_latency: float = 0.5,
+                 playlist_size: int = 1000):
+        self.infos = infos
+        self.search_latency = search_latency
+        self.extract_latency = extract_latency
+        self.playlist_size = playlist_size
+        self.calls = 0
+
+        self._by_url = {info['webpage_url']: info for info in infos}
+
+    def extract_info(self, url: str, download: bool = False, process: bool = True):
+        self.calls += 1
+        info = self._by_url.get(url)
+        if info is not None:
+            time.sleep(self.extract_latency if process else self.search_latency)
+            return dict(info)
+
+        time.sleep(self.search_latency)
+        if 'list=' in url:
+            entries = (self._flat(self.infos[i % len(self.infos)]) for i in range(self.playlist_size))
+            return {'_type': 'playlist', 'title': 'Benchmark playlist', 'entries': entries}
+
+        info = self.infos[zlib.crc32(url.encode()) % len(self.infos)]
+        return {'_type': 'playlist', 'entries': iter([self._flat(info)])}
+
+    @staticmethod
+    def _flat(info: dict):
+        return {
+            '_type': 'url',
+            'ie_key': 'Youtube',
+            'id': info['id'],
+            'url': info['id'],
+            'webpage_url': info['webpage_url'],
+            'title': info['title'],
+            'uploader': info['uploader'],
+            'duration': info['duration'],
+        }
+
+
+class SilentAudio(discord.AudioSource):
+    """Opus silence for `duration` seconds, for runs without FFmpeg."""
+
+    def __init__(self, duration: float):
+        self.remaining = int(duration * 1000 / discord.opus.Encoder.FRAME_LENGTH)
+
+    def read(self):
+        if self.remaining <= 0:
+            return b''
+
+        self.remaining -= 1
+        return OPUS_SILENCE
+
+    def is_opus(self):
+        return True
+
+
+class FakeVoiceClient:
+    """Consumes frames in real time on its own thread, encoding PCM to Opus
+    the way discord.py's AudioPlayer does, and records when the first frame
+    was read."""
+
+    def __init__(self, channel: 'FakeVoiceChannel'):
+        self.channel = channel
+        self.guild = channel.guild
+        self.source = None
+        self.frames = 0
+        self.first_frame_at = None
+
+        self._thread = None
+        self._stopped = threading.Event()
+        self._resumed = threading.Event()
+        self._resumed.set()
+
+    def play(self, source: discord.AudioSource, *, after=None):
+        if self.is_playing():
+            raise discord.ClientException('Already playing audio.')
+
+        self.source = source
+        self._stopped.clear()
+        self._resumed.set()
+        self._thread = threading.Thread(target=self._run, args=(source, after), daemon=True)
+        self._thread.start()
+
+    def _run(self, source: discord.AudioSource, after):
+        encoder = None
+        if not source.is_opus() and discord.opus.is_loaded():
+            encoder = discord.opus.Encoder()
+
+        error = None
+        due = time.perf_counter()
+        try:
+            while not self._stopped.is_set():
+                if not self._resumed.is_set():
+                    self._resumed.wait()
+                    due = time.perf_counter()
+                    continue
+
+                frame = source.read()
+                if not frame:
+                    break
+                if self.first_frame_at is None:
+                    self.first_frame_at = time.perf_counter()
+                if encoder is not None:
+                    encoder.encode(frame, encoder.SAMPLES_PER_FRAME)
+                self.frames += 1
+
+                due += discord.opus.Encoder.FRAME_LENGTH / 1000
+                delay = due - time.perf_counter()
+                if delay > 0:
+                    time.sleep(delay)
+        except Exception as e:
+            error = e
+        finally:
+            source.cleanup()
+            self.source = None
+
+        if after is not None:
+            after(error)
+
+    def is_playing(self):
+        return self._thread is not None and self._thread.is_alive() and self._resumed.is_set()
+
+    def is_paused(self):
+        return self._thread is not None and self._thread.is_alive() and not self._resumed.is_set()
+
+    def pause(self):
+        self._resumed.clear()
+
+    def resume(self):
+        self._resumed.set()
+
+    def stop(self):
+        self._stopped.set()
+        self._resumed.set()
+
+    async def move_to(self, channel: 'FakeVoiceChannel'):
+        self.channel = channel
+
+    async def disconnect(self, *, force: bool = False):
+        self.stop()
+        if self.guild.voice_client is self:
+            self.guild.voice_client = None
+
+
+class FakeTyping:
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc_info):
+        pass
+
+
+class FakeMessage:
+    def __init__(self, content: str, *, author=None, channel=None, embed: discord.Embed = None):
+        self.id = next(_ids)
+        self.content = content
+        self.embed = embed
+        self.author = author
+        self.channel = channel
+        self.guild = getattr(channel, 'guild', None)
+        self._state = None
+
+    async def add_reaction(self, emoji):
+        pass
+
+    async def edit(self, *, content: str = None, embed: discord.Embed = None):
+        self.content = content if content is not None else self.content
+        self.embed = embed or self.embed
+
+    async def delete(self):
+        pass
+
+
+class FakeTextChannel:
+    def __init__(self, guild: 'FakeGuild', name: str):
+        self.id = next(_ids)
+        self.guild = guild
+        self.name = name
+        self.sent = 0
+
+    async def send(self, content: str = None, *, embed: discord.Embed = None, **kwargs):
+        self.sent += 1
+        return FakeMessage(content, channel=self, embed=embed)
+
+    def typing(self):
+        return FakeTyping()
+
+    def permissions_for(self, member):
+        return discord.Permissions.all()
+
+
+class FakeVoiceChannel:
+    def __init__(self, guild: 'FakeGuild', name: str):
+        self.id = next(_ids)
+        self.guild = guild
+        self.name = name
+        self.bitrate = 64000
+
+    async def connect(self, **kwargs):
+        if self.guild.voice_client is not None:
+            raise discord.ClientException('Already connected to a voice channel.')
+
+        self.guild.voice_client = FakeVoiceClient(self)
+        return self.guild.voice_client
+
+
+class FakeMember:
+    def __init__(self, guild: 'FakeGuild', name: str, *, voice_channel: FakeVoiceChannel = None):
+        self.id = next(_ids)
+        self.guild = guild
+        self.name = name
+        self.nick = name
+        self.discriminator = '{:04d}'.format(self.id % 10000)
+        self.bot = False
+        self.voice = _VoiceState(voice_channel) if voice_channel is not None else None
+
+    def __str__(self):
+        return '{0.name}#{0.discriminator}'.format(self)
+
+    @property
+    def mention(self):
+        return '<@{}>'.format(self.id)
+
+
+class _VoiceState:
+    def __init__(self, channel: FakeVoiceChannel):
+        self.channel = channel
+
+
+class FakeGuild:
+    def __init__(self, index: int):
+        self.id = next(_ids)
+        self.name = 'bench-{}'.format(index)
+        self.voice_client = None
+        self.text_channel = FakeTextChannel(self, 'general')
+        self.voice_channel = FakeVoiceChannel(self, 'music')
+        self.member = FakeMember(self, 'listener{}'.format(index), voice_channel=self.voice_channel)
+        self.system_channel = self.text_channel
+
+    def get_channel(self, channel_id: int):
+        for channel in (self.text_channel, self.voice_channel):
+            if channel.id == channel_id:
+                return channel
+
+        return None
+
+
+class BenchContext(commands.Context):
+    """Replies go to the fake channel instead of the HTTP API."""
+
+    async def send(self, content: str = None, **kwargs):
+        return await self.channel.send(content, **kwargs)
+
+    def typing(self):
+        return self.channel.typing()
+
+
+class FakeGateway:
+    """Feeds messages from fake guilds to the bot as if they came from Discord."""
+
+    def __init__(self, bot: commands.Bot, guilds: int):
+        self.bot = bot
+        self.guilds = [FakeGuild(i) for i in range(guilds)]
+
+        bot._connection.user = FakeMember(None, 'Krulcifer')
+        bot.get_context = self._get_context
+
+    async def _get_context(self, message: FakeMessage, *, cls=BenchContext):
+        return await commands.Bot.get_context(self.bot, message, cls=BenchContext)
+
+    async def send(self, guild: FakeGuild, content: str):
+        message = FakeMessage(content, author=guild.member, channel=guild.text_channel)
+        await self.bot.on_message(message)
+        return message
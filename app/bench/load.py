@@ -0,0 +1,237 @@
+"""Offline load test of the Music cog and on_message.
+
+Runs the real cog, SongQueue, VoiceState and on_message against the fakes in
+bench/fakes.py, with no network access, and reports:
+
+* message throughput of on_message (moderation, replies and commands),
+* @play-to-first-frame latency with every guild starting at once,
+* CPU per playing stream (this process plus FFmpeg),
+* memory per queued track after a large @playlist import.
+
+    python -m bench.load [--guilds 20] [--messages 5000] [--tracks 2000] [--json]
+
+Streams are a local FFmpeg test tone; `--source silence` skips FFmpeg.
+"""
+import argparse
+import asyncio
+import json
+import os
+import resource
+import shutil
+import subprocess
+import tempfile
+import time
+import tracemalloc
+
+import discord
+
+import extraction
+from bench.fakes import FakeGateway, FakeYoutubeDL, SilentAudio, canned_infos
+from extraction import ExtractionEngine
+from main import Music, YTDLSource, bot, loop_monitor
+from ytdl_cache import MetadataCache
+
+
+CHATTER = (
+    'anyone up for some games tonight?',
+    'that was a damn good match',
+    'has anyone seen janray today',
+    'lol',
+    '@queue',
+    'brb getting food, the stream starts at nine so save me a seat please',
+)
+
+
+def generate_tone(directory: str, seconds: int):
+    path = os.path.join(directory, 'tone.webm')
+    subprocess.run(['ffmpeg', '-loglevel', 'error', '-f', 'lavfi', '-i',
+                    'sine=frequency=440:duration={}'.format(seconds), '-ac', '2', '-ar', '48000',
+                    '-c:a', 'libopus', '-b:a', '128k', path], check=True)
+    return path
+
+
+def cpu_time():
+    usage = resource.getrusage(resource.RUSAGE_CHILDREN)
+    return time.process_time() + usage.ru_utime + usage.ru_stime
+
+
+def quantile(values: list, q: float):
+    values = sorted(values)
+    return values[min(int(q * len(values)), len(values) - 1)] if values else 0.0
+
+
+async def bench_messages(gateway: FakeGateway, count: int):
+    latencies = []
+    started = time.perf_counter()
+    for i in range(count):
+        guild = gateway.guilds[i % len(gateway.guilds)]
+        sent = time.perf_counter()
+        await gateway.send(guild, CHATTER[i % len(CHATTER)])
+        latencies.append(time.perf_counter() - sent)
+    elapsed = time.perf_counter() - started
+
+    return {
+        'messages': count,
+        'per_second': count / elapsed,
+        'p50_ms': quantile(latencies, 0.5) * 1000,
+        'p99_ms': quantile(latencies, 0.99) * 1000,
+    }
+
+
+async def bench_play(gateway: FakeGateway, timeout: float):
+    async def play(guild):
+        sent = time.perf_counter()
+        await gateway.send(guild, '@play benchmark song {}'.format(guild.name))
+        while guild.voice_client is None or guild.voice_client.first_frame_at is None:
+            if time.perf_counter() - sent > timeout:
+                return None
+            await asyncio.sleep(0.005)
+
+        return guild.voice_client.first_frame_at - sent
+
+    latencies = await asyncio.gather(*(play(guild) for guild in gateway.guilds))
+    played = [latency for latency in latencies if latency is not None]
+
+    return {
+        'guilds': len(latencies),
+        'timed_out': len(latencies) - len(played),
+        'p50_ms': quantile(played, 0.5) * 1000,
+        'p99_ms': quantile(played, 0.99) * 1000,
+        'max_ms': max(played, default=0.0) * 1000,
+    }
+
+
+async def bench_streams(gateway: FakeGateway, seconds: float):
+    streams = sum(1 for guild in gateway.guilds if guild.voice_client and guild.voice_client.is_playing())
+    frames = sum(guild.voice_client.frames for guild in gateway.guilds if guild.voice_client)
+    cpu, wall = cpu_time(), time.perf_counter()
+    await asyncio.sleep(seconds)
+    cpu, wall = cpu_time() - cpu, time.perf_counter() - wall
+    frames = sum(guild.voice_client.frames for guild in gateway.guilds if guild.voice_client) - frames
+
+    return {
+        'streams': streams,
+        'core_per_stream': cpu / wall / streams if streams else 0.0,
+        # Below 1.0 the fake voice clients fell behind real time.
+        'realtime': frames * discord.opus.Encoder.FRAME_LENGTH / 1000 / wall / streams if streams else 0.0,
+    }
+
+
+async def bench_queue(gateway: FakeGateway, music: Music, tracks: int):
+    guild = gateway.guilds[0]
+    tracemalloc.start()
+    before = tracemalloc.get_traced_memory()[0]
+
+    await gateway.send(guild, '@playlist https://www.youtube.com/playlist?list=bench')
+    state = music.voice_states[guild.id]
+    started = time.perf_counter()
+    if state.importing is not None:
+        await asyncio.wait([state.importing])
+    elapsed = time.perf_counter() - started
+
+    traced = tracemalloc.get_traced_memory()[0] - before
+    tracemalloc.stop()
+
+    queued = len(state.songs)
+    return {
+        'tracks': queued,
+        'import_s': elapsed,
+        'bytes_per_track': traced / queued if queued else 0.0,
+        'estimated_bytes_per_track': state.memory() / queued if queued else 0.0,
+    }
+
+
+async def run(args: argparse.Namespace, stream_url: str):
+    infos = canned_infos(args.catalogue, stream_url, duration=int(args.seconds * 3 + args.timeout + 60))
+    if args.infos:
+        with open(args.infos) as f:
+            recorded = json.load(f)
+        for info in recorded:
+            info.update(url=stream_url, acodec='opus')
+        infos = recorded + infos
+
+    ytdl = FakeYoutubeDL(infos, search_latency=args.search_latency, extract_latency=args.extract_latency,
+                         playlist_size=args.tracks)
+    extraction._get_ytdl = lambda flat=False: ytdl
+
+    # A fresh cache and a thread pool, so the fake extractor is shared and
+    # every run starts cold.
+    YTDLSource.extractor = ExtractionEngine(YTDLSource.YTDL_OPTIONS, workers=args.workers, mode='thread',
+                                       max_pending=args.tracks)
+    YTDLSource.cache = MetadataCache()
+    YTDLSource.audio_cache = None
+    YTDLSource.FFMPEG_OPTIONS = {'before_options': '', 'options': '-vn'}
+    if args.source == 'silence':
+        YTDLSource._open = lambda self, position=0.0: SilentAudio(int(self.data.get('duration') or 0))
+    Music.PLAYLIST_LIMIT = args.tracks
+
+    gateway = FakeGateway(bot, args.guilds)
+    music = bot.get_cog('Music')
+
+    results = {
+        'messages': await bench_messages(gateway, args.messages),
+        'play': await bench_play(gateway, args.timeout),
+        'streams': await bench_streams(gateway, args.seconds),
+        'queue': await bench_queue(gateway, music, args.tracks),
+    }
+    results['extractor'] = dict(YTDLSource.extractor.stats(), calls=ytdl.calls)
+    results['loop'] = loop_monitor.stats()
+
+    for state in list(music.voice_states.values()):
+        await music.evict(state, force=True)
+    YTDLSource.extractor.close()
+
+    return results
+
+
+def report(results: dict):
+    messages, play, streams, queue = (results[key] for key in ('messages', 'play', 'streams', 'queue'))
+    print('on_message   {:>9.0f} msg/s   p50 {:>7.2f}ms   p99 {:>7.2f}ms'.format(
+        messages['per_second'], messages['p50_ms'], messages['p99_ms']))
+    print('first frame  {:>9} guilds  p50 {:>7.0f}ms   p99 {:>7.0f}ms   max {:.0f}ms, {} timed out'.format(
+        play['guilds'], play['p50_ms'], play['p99_ms'], play['max_ms'], play['timed_out']))
+    print('streams      {:>9} playing {:>8.2%} core/stream at {:.2f}x real time'.format(
+        streams['streams'], streams['core_per_stream'], streams['realtime']))
+    print('queue        {:>9} tracks  {:>7.0f} B/track ({:.0f} B estimated), imported in {:.1f}s'.format(
+        queue['tracks'], queue['bytes_per_track'], queue['estimated_bytes_per_track'], queue['import_s']))
+    print('loop lag     p50 {:.1f}ms   p99 {:.1f}ms   max {:.1f}ms   {} stalls'.format(
+        results['loop']['p50'] * 1000, results['loop']['p99'] * 1000, results['loop']['max'] * 1000,
+        results['loop']['stalls']))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--guilds', type=int, default=20)
+    parser.add_argument('--messages', type=int, default=5000)
+    parser.add_argument('--tracks', type=int, default=2000, help='size of the @playlist import')
+    parser.add_argument('--catalogue', type=int, default=500, help='distinct canned tracks')
+    parser.add_argument('--infos', help='JSON list of recorded info dicts to replay as well')
+    parser.add_argument('--search-latency', type=float, default=0.2)
+    parser.add_argument('--extract-latency', type=float, default=0.5)
+    parser.add_argument('--workers', type=int, default=2)
+    parser.add_argument('--seconds', type=float, default=10, help='how long streams are measured')
+    parser.add_argument('--timeout', type=float, default=60, help='longest wait for a first frame')
+    parser.add_argument('--source', choices=('tone', 'silence'), default='tone')
+    parser.add_argument('--json', action='store_true', help='print the results as JSON')
+    args = parser.parse_args()
+
+    if not discord.opus.is_loaded():
+        discord.opus._load_default()
+    if args.source == 'tone' and shutil.which('ffmpeg') is None:
+        parser.error('FFmpeg is not installed, use --source silence')
+
+    with tempfile.TemporaryDirectory() as directory:
+        stream_url = 'silence'
+        if args.source == 'tone':
+            stream_url = generate_tone(directory, int(args.seconds * 3 + args.timeout + 60))
+
+        results = bot.loop.run_until_complete(run(args, stream_url))
+
+    if args.json:
+        print(json.dumps(results, indent=2))
+    else:
+        report(results)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,137 @@
+"""ChunkedList against the deque SongQueue used to wrap.
+
+Times the operations the queue commands use, at several queue sizes, in
+microseconds per operation, then SongQueue's own insert, duplicate check
+and dedupe against scanning the queue for them:
+
+    python -m bench.queue [--sizes 1000 10000 100000] [--ops 2000]
+"""
+import argparse
+import collections
+import itertools
+import random
+import time
+import types
+
+from chunked import ChunkedList
+from main import SongQueue
+
+
+def page(queue, i: int, j: int):
+    if isinstance(queue, ChunkedList):
+        return queue[i:i + 10]
+
+    return list(itertools.islice(queue, i, i + 10))
+
+
+def index(queue, i: int, j: int):
+    return queue[i]
+
+
+def remove(queue, i: int, j: int):
+    # Appending keeps the size steady across iterations.
+    del queue[i]
+    queue.append(None)
+
+
+def insert(queue, i: int, j: int):
+    queue.insert(i, None)
+    queue.pop()
+
+
+def move(queue, i: int, j: int):
+    if isinstance(queue, ChunkedList):
+        return queue.move(i, j)
+
+    item = queue[i]
+    del queue[i]
+    queue.insert(j, item)
+
+
+def rotate(queue, i: int, j: int):
+    queue.append(queue.popleft())
+
+
+OPERATIONS = (index, page, remove, insert, move, rotate)
+
+
+def song(video_id: int):
+    return types.SimpleNamespace(track=types.SimpleNamespace(id=str(video_id)))
+
+
+def queued_insert(queue: SongQueue, i: int, j: int):
+    queue.insert(i, song(j))
+    queue.remove(i)
+
+
+def scan_contains(queue: SongQueue, i: int, j: int):
+    return any(queued.track.id == str(j) for queued in queue)
+
+
+def has_track(queue: SongQueue, i: int, j: int):
+    return queue.has_track(str(j))
+
+
+def scan_dedupe(queue: SongQueue, i: int, j: int):
+    # What dedupe() did before it kept the id counts: scan and rebuild.
+    seen = set()
+    songs = [queued for queued in queue if not (queued.track.id in seen or seen.add(queued.track.id))]
+    queue._queue.replace(songs)
+
+
+def dedupe(queue: SongQueue, i: int, j: int):
+    queue.dedupe()
+
+
+# (operation, baseline it replaces or None)
+QUEUE_OPERATIONS = ((queued_insert, None), (has_track, scan_contains), (dedupe, scan_dedupe))
+
+
+def measure(queue, operation, positions: list):
+    started = time.perf_counter()
+    for i, j in positions:
+        operation(queue, i, j)
+
+    return (time.perf_counter() - started) / len(positions) * 1e6
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--sizes', type=int, nargs='+', default=[1000, 10000, 100000])
+    parser.add_argument('--ops', type=int, default=2000)
+    args = parser.parse_args()
+
+    print('{:<16} {:>8} {:>10} {:>10} {:>8}'.format('operation', 'size', 'deque us', 'chunked us', 'speedup'))
+    for size in args.sizes:
+        # Indices are drawn from the middle half of the queue, where deques are slowest.
+        positions = [(random.randrange(size // 4, size * 3 // 4), random.randrange(size // 4, size * 3 // 4))
+                     for _ in range(args.ops)]
+        for operation in OPERATIONS:
+            deque_us = measure(collections.deque(range(size)), operation, positions)
+            chunked_us = measure(ChunkedList(range(size)), operation, positions)
+            print('{:<16} {:>8} {:>10.2f} {:>10.2f} {:>7.1f}x'.format(
+                operation.__name__, size, deque_us, chunked_us, deque_us / chunked_us))
+
+    # Queues without duplicates, the common case for dedupe(); lookups miss
+    # half the time.
+    print()
+    print('{:<16} {:>8} {:>10} {:>10} {:>8}'.format('SongQueue', 'size', 'scan us', 'indexed us', 'speedup'))
+    for size in args.sizes:
+        positions = [(random.randrange(size), random.randrange(size * 2)) for _ in range(args.ops)]
+        for operation, baseline in QUEUE_OPERATIONS:
+            queue = SongQueue()
+            for video_id in range(size):
+                queue.put_nowait(song(video_id))
+            indexed_us = measure(queue, operation, positions)
+            if baseline is None:
+                print('{:<16} {:>8} {:>10} {:>10.2f} {:>8}'.format(operation.__name__, size, '-', indexed_us, '-'))
+                continue
+
+            # Scans take O(n) each; a tenth of the positions is plenty.
+            scan_us = measure(queue, baseline, positions[:max(len(positions) // 10, 1)])
+            print('{:<16} {:>8} {:>10.2f} {:>10.2f} {:>7.1f}x'.format(
+                operation.__name__, size, scan_us, indexed_us, scan_us / indexed_us))
+
+
+if __name__ == '__main__':
+    main()
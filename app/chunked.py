@@ -0,0 +1,201 @@
+import itertools
+
+
+class ChunkedList:
+    """A list stored as chunks of roughly `load` items.
+
+    A Fenwick tree over the chunk lengths finds the chunk holding any index
+    in O(log n), so indexing, insertion and removal anywhere cost
+    O(log n + load) instead of O(n), and a slice starting deep in the list
+    doesn't walk from the head. Chunks are split when they grow past twice
+    `load` and merged when they shrink below half of it; only then is the
+    tree rebuilt.
+    """
+
+    def __init__(self, iterable=(), *, load: int = 256):
+        self.load = load
+        self._chunks = []
+        self._tree = [0]
+        self._len = 0
+        self._build(list(iterable))
+
+    def _build(self, items: list):
+        self._chunks = [items[i:i + self.load] for i in range(0, len(items), self.load)]
+        self._len = len(items)
+        self._rebuild()
+
+    def _rebuild(self):
+        tree = [0]
+        tree.extend(len(chunk) for chunk in self._chunks)
+        size = len(tree) - 1
+        for i in range(1, size + 1):
+            parent = i + (i & -i)
+            if parent <= size:
+                tree[parent] += tree[i]
+        self._tree = tree
+
+    def _update(self, pos: int, delta: int):
+        tree = self._tree
+        i = pos + 1
+        while i < len(tree):
+            tree[i] += delta
+            i += i & -i
+
+    def _locate(self, index: int):
+        """Returns the chunk position and offset of `index`."""
+        tree = self._tree
+        pos = 0
+        bit = 1 << (len(tree) - 1).bit_length()
+        while bit:
+            following = pos + bit
+            if following < len(tree) and tree[following] <= index:
+                pos = following
+                index -= tree[following]
+            bit >>= 1
+
+        return pos, index
+
+    def _normalize(self, index: int):
+        if index < 0:
+            index += self._len
+        if not 0 <= index < self._len:
+            raise IndexError('ChunkedList index out of range')
+
+        return index
+
+    def __len__(self):
+        return self._len
+
+    def __iter__(self):
+        return itertools.chain.from_iterable(self._chunks)
+
+    def __reversed__(self):
+        for chunk in reversed(self._chunks):
+            yield from reversed(chunk)
+
+    def __repr__(self):
+        return 'ChunkedList({!r})'.format(list(self))
+
+    def __sizeof__(self):
+        return (object.__sizeof__(self) + self._chunks.__sizeof__() + self._tree.__sizeof__()
+                + sum(chunk.__sizeof__() for chunk in self._chunks))
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            start, stop, step = index.indices(self._len)
+            if step != 1:
+                return list(self)[index]
+            if start >= stop:
+                return []
+
+            pos, offset = self._locate(start)
+            items = []
+            count = stop - start
+            for chunk in itertools.islice(self._chunks, pos, None):
+                items.extend(chunk[offset:offset + count - len(items)])
+                offset = 0
+                if len(items) >= count:
+                    break
+
+            return items
+
+        pos, offset = self._locate(self._normalize(index))
+        return self._chunks[pos][offset]
+
+    def __setitem__(self, index: int, value):
+        pos, offset = self._locate(self._normalize(index))
+        self._chunks[pos][offset] = value
+
+    def __delitem__(self, index: int):
+        self._delete(*self._locate(self._normalize(index)))
+
+    def _delete(self, pos: int, offset: int):
+        chunk = self._chunks[pos]
+        del chunk[offset]
+        self._len -= 1
+
+        if not chunk:
+            del self._chunks[pos]
+            self._rebuild()
+            return
+        if len(chunk) >= self.load // 2 or len(self._chunks) == 1:
+            self._update(pos, -1)
+            return
+
+        # Merge the small chunk into a neighbour, splitting it again if that
+        # made it too big.
+        if pos + 1 < len(self._chunks):
+            merged = chunk + self._chunks[pos + 1]
+            del self._chunks[pos:pos + 2]
+        else:
+            pos -= 1
+            merged = self._chunks[pos] + chunk
+            del self._chunks[pos:pos + 2]
+
+        if len(merged) > self.load * 2:
+            half = len(merged) // 2
+            self._chunks[pos:pos] = [merged[:half], merged[half:]]
+        else:
+            self._chunks.insert(pos, merged)
+        self._rebuild()
+
+    def insert(self, index: int, value):
+        if index < 0:
+            index = max(index + self._len, 0)
+        index = min(index, self._len)
+
+        if not self._chunks:
+            self._chunks.append([value])
+            self._len = 1
+            self._rebuild()
+            return
+
+        if index == self._len:
+            pos = len(self._chunks) - 1
+            chunk = self._chunks[pos]
+            chunk.append(value)
+        else:
+            pos, offset = self._locate(index)
+            chunk = self._chunks[pos]
+            chunk.insert(offset, value)
+        self._len += 1
+
+        if len(chunk) > self.load * 2:
+            self._chunks[pos:pos + 1] = [chunk[:self.load], chunk[self.load:]]
+            self._rebuild()
+        else:
+            self._update(pos, 1)
+
+    def append(self, value):
+        self.insert(self._len, value)
+
+    def extend(self, iterable):
+        for value in iterable:
+            self.append(value)
+
+    def pop(self, index: int = -1):
+        pos, offset = self._locate(self._normalize(index))
+        value = self._chunks[pos][offset]
+        self._delete(pos, offset)
+
+        return value
+
+    def popleft(self):
+        if not self._len:
+            raise IndexError('pop from an empty ChunkedList')
+
+        value = self._chunks[0][0]
+        self._delete(0, 0)
+
+        return value
+
+    def move(self, source: int, destination: int):
+        """Moves the item at `source` so it ends up at index `destination`."""
+        self.insert(destination, self.pop(source))
+
+    def replace(self, iterable):
+        """Replaces the contents in O(n), e.g. after a shuffle."""
+        self._build(list(iterable))
+
+    def clear(self):
+        self._build([])
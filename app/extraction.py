@@ -0,0 +1,271 @@
+import asyncio
+import collections
+import concurrent.futures
+import contextlib
+import functools
+import itertools
+import multiprocessing
+import sys
+import threading
+import time
+import types
+from concurrent.futures.process import BrokenProcessPool
+
+from metrics import Histogram
+
+
+EXTRACTION_SECONDS = Histogram(
+    'krulcifer_extraction_seconds', 'Time from queueing an extract_info call to its result.', labels=('kind',))
+
+
+class ExtractionError(Exception):
+    pass
+
+
+class ExtractionBusy(ExtractionError):
+    def __init__(self, message: str, guild_id: int = None):
+        super().__init__(message)
+        # Set when only this guild's queue is full, not the whole extractor.
+        self.guild_id = guild_id
+
+
+# Worker-side state. Every worker process (or thread, in thread mode) lazily
+# builds its own YoutubeDL, which is not safe to share between threads.
+_options = None
+_local = threading.local()
+
+
+def _init_worker(options: dict):
+    global _options
+    _options = options
+
+
+def _get_ytdl(flat: bool = False):
+    attr = 'flat_ytdl' if flat else 'ytdl'
+    ytdl = getattr(_local, attr, None)
+    if ytdl is None:
+        import youtube_dl
+
+        youtube_dl.utils.bug_reports_message = lambda: ''
+        options = _options
+        if flat:
+            options = dict(options, extract_flat='in_playlist', noplaylist=False)
+        ytdl = youtube_dl.YoutubeDL(options)
+        setattr(_local, attr, ytdl)
+
+    return ytdl
+
+
+@contextlib.contextmanager
+def _without_main():
+    """Hides the main module while worker processes are started.
+
+    Spawned and forkserver workers otherwise run main.py again, bot setup,
+    caches and all, though they only need this module. Workers are started
+    synchronously from `submit()` on the calling thread.
+    """
+    main = sys.modules['__main__']
+    sys.modules['__main__'] = types.ModuleType('__main__')
+    try:
+        yield
+    finally:
+        sys.modules['__main__'] = main
+
+
+def _warm():
+    # Building a YoutubeDL imports and instantiates every extractor.
+    _get_ytdl()
+    _get_ytdl(flat=True)
+
+
+def _extract(url: str, process: bool, flat: bool, start: int, stop: int):
+    try:
+        data = _get_ytdl(flat).extract_info(url, download=False, process=process)
+        if data is not None and 'entries' in data:
+            # Slice the way youtube_dl applies playliststart/playlistend: a
+            # PagedList only fetches the pages the slice needs, a generator
+            # is pulled up to `stop`.
+            entries = data['entries']
+            if hasattr(entries, 'getslice'):
+                data['entries'] = entries.getslice(start, stop)
+            else:
+                data['entries'] = list(itertools.islice(entries, start, stop))
+    except Exception as e:
+        # youtube_dl errors carry tracebacks that can't cross the process boundary.
+        raise ExtractionError(str(e)) from None
+
+    return data
+
+
+class _Job:
+    __slots__ = ('future', 'args', 'kind', 'queued_at')
+
+    def __init__(self, future: asyncio.Future, kind: str, *args):
+        self.future = future
+        self.args = args
+        self.kind = kind
+        self.queued_at = time.perf_counter()
+
+
+class ExtractionEngine:
+    """Runs blocking `extract_info` calls on a dedicated, bounded worker pool.
+
+    At most `workers` jobs are handed to the pool at a time; everything else
+    waits in a per-guild queue and guilds are served round-robin, so one
+    guild queueing many links can't starve the others.
+    """
+
+    def __init__(self, options: dict, *, workers: int = 2, mode: str = 'process',
+                 max_pending: int = 8, max_total: int = 256):
+        if mode not in ('process', 'thread'):
+            raise ValueError('mode must be "process" or "thread", not {!r}'.format(mode))
+
+        self.options = options
+        self.workers = workers
+        self.mode = mode
+        self.max_pending = max_pending
+        self.max_total = max_total
+
+        self._executor = None
+        self._queues = {}
+        self._rotation = collections.deque()
+        self._queued = 0
+        self._active = 0
+
+        self.completed = 0
+        self.failed = 0
+        self.rejected = 0
+
+    def _get_executor(self):
+        if self._executor is None:
+            if self.mode == 'process':
+                # Forking would copy the event loop, player and monitor
+                # threads' state into the workers mid-flight.
+                methods = multiprocessing.get_all_start_methods()
+                context = multiprocessing.get_context('forkserver' if 'forkserver' in methods else 'spawn')
+                self._executor = concurrent.futures.ProcessPoolExecutor(
+                    self.workers, mp_context=context, initializer=_init_worker, initargs=(self.options,))
+            else:
+                self._executor = concurrent.futures.ThreadPoolExecutor(
+                    self.workers, thread_name_prefix='ytdl', initializer=_init_worker,
+                    initargs=(self.options,))
+
+        return self._executor
+
+    def _submit(self, loop: asyncio.AbstractEventLoop, func, *args):
+        executor = self._get_executor()
+        try:
+            if self.mode == 'process':
+                with _without_main():
+                    return loop.run_in_executor(executor, func, *args)
+            return loop.run_in_executor(executor, func, *args)
+        except BrokenProcessPool as e:
+            self._reset(executor)
+            raise ExtractionError('The extractor crashed, try again.') from e
+
+    def _reset(self, executor):
+        """Drops a pool whose worker died; the next job starts a new one."""
+        if self._executor is executor:
+            self._executor = None
+            executor.shutdown(wait=False)
+
+    async def warm(self):
+        """Starts the workers and has them build their YoutubeDLs, so the
+        first extraction doesn't pay for it."""
+        loop = asyncio.get_event_loop()
+        await asyncio.gather(*(self._submit(loop, _warm) for _ in range(self.workers)))
+
+    async def extract(self, url: str, *, guild_id: int = None, process: bool = True, flat: bool = False,
+                      start: int = 0, stop: int = None):
+        queue = self._queues.get(guild_id)
+        if queue is not None and len(queue) >= self.max_pending:
+            self.rejected += 1
+            raise ExtractionBusy('Too many pending requests for this server, try again in a moment.', guild_id)
+        if self._queued >= self.max_total:
+            self.rejected += 1
+            raise ExtractionBusy('The extractor is overloaded, try again in a moment.')
+
+        loop = asyncio.get_event_loop()
+        kind = 'flat' if flat else 'full' if process else 'search'
+        job = _Job(loop.create_future(), kind, url, process, flat, start, stop)
+
+        if queue is None:
+            queue = self._queues[guild_id] = collections.deque()
+            self._rotation.append(guild_id)
+        queue.append(job)
+        self._queued += 1
+
+        self._dispatch(loop)
+        return await job.future
+
+    def _dispatch(self, loop: asyncio.AbstractEventLoop):
+        while self._active < self.workers and self._rotation:
+            guild_id = self._rotation.popleft()
+            queue = self._queues[guild_id]
+            job = queue.popleft()
+            self._queued -= 1
+
+            if queue:
+                self._rotation.append(guild_id)
+            else:
+                del self._queues[guild_id]
+
+            if job.future.done():
+                continue
+
+            executor = self._get_executor()
+            try:
+                pending = self._submit(loop, _extract, *job.args)
+            except ExtractionError as e:
+                self.failed += 1
+                job.future.set_exception(e)
+                continue
+
+            self._active += 1
+            pending.add_done_callback(functools.partial(self._finished, loop, job, executor))
+
+    def _finished(self, loop: asyncio.AbstractEventLoop, job: _Job, executor, pending: asyncio.Future):
+        self._active -= 1
+        EXTRACTION_SECONDS.observe(time.perf_counter() - job.queued_at, kind=job.kind)
+
+        error = None if pending.cancelled() else pending.exception()
+        if isinstance(error, BrokenProcessPool):
+            # A worker died (e.g. killed for memory); every job on the pool fails.
+            self._reset(executor)
+            error = ExtractionError('The extractor crashed, try again.')
+
+        if not job.future.done():
+            if pending.cancelled():
+                job.future.cancel()
+            elif error is not None:
+                self.failed += 1
+                job.future.set_exception(error)
+            else:
+                self.completed += 1
+                job.future.set_result(pending.result())
+
+        self._dispatch(loop)
+
+    def delay(self):
+        """Seconds the oldest queued job has been waiting for a worker."""
+        if not self._queued:
+            return 0.0
+
+        return time.perf_counter() - min(queue[0].queued_at for queue in self._queues.values() if queue)
+
+    def stats(self):
+        return {
+            'mode': self.mode,
+            'workers': self.workers,
+            'active': self._active,
+            'queued': self._queued,
+            'guilds_waiting': len(self._queues),
+            'completed': self.completed,
+            'failed': self.failed,
+            'rejected': self.rejected,
+        }
+
+    def close(self):
+        if self._executor is not None:
+            self._executor.shutdown(wait=False)
+            self._executor = None
@@ -0,0 +1,177 @@
+import asyncio
+import hmac
+import itertools
+import json
+
+
+class IPCError(Exception):
+    pass
+
+
+async def _send(writer: asyncio.StreamWriter, message: dict):
+    writer.write(json.dumps(message, separators=(',', ':')).encode() + b'\n')
+    await writer.drain()
+
+
+async def _receive(reader: asyncio.StreamReader):
+    line = await reader.readline()
+    if not line:
+        return None
+
+    return json.loads(line)
+
+
+class IPCHub:
+    """Runs in the launcher. Cluster processes connect to it over localhost,
+    and a request from one cluster is fanned out to every cluster with the
+    replies gathered back to the caller."""
+
+    def __init__(self, secret: str, *, host: str = '127.0.0.1', port: int = 0, timeout: float = 5.0):
+        self.secret = secret
+        self.host = host
+        self.port = port
+        self.timeout = timeout
+
+        self._server = None
+        self._clients = {}
+        self._waiting = {}
+        self._ids = itertools.count()
+
+    async def start(self):
+        self._server = await asyncio.start_server(self._serve, self.host, self.port)
+        self.port = self._server.sockets[0].getsockname()[1]
+
+    async def close(self):
+        if self._server is not None:
+            self._server.close()
+            await self._server.wait_closed()
+
+    async def _serve(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        cluster = None
+        try:
+            hello = await asyncio.wait_for(_receive(reader), self.timeout)
+            if not hello or not hmac.compare_digest(str(hello.get('secret')), self.secret):
+                return
+
+            cluster = hello['cluster']
+            self._clients[cluster] = writer
+            while True:
+                message = await _receive(reader)
+                if message is None:
+                    break
+
+                if 'reply' in message:
+                    future = self._waiting.get(message['reply'])
+                    if future is not None and not future.done():
+                        future.set_result(message.get('result'))
+                else:
+                    asyncio.ensure_future(self._fan_out(writer, message))
+        except (asyncio.TimeoutError, ConnectionError, ValueError):
+            pass
+        finally:
+            if cluster is not None and self._clients.get(cluster) is writer:
+                del self._clients[cluster]
+            writer.close()
+
+    async def _ask(self, cluster: int, writer: asyncio.StreamWriter, op: str, payload):
+        key = next(self._ids)
+        future = self._waiting[key] = asyncio.get_event_loop().create_future()
+        try:
+            await _send(writer, {'id': key, 'op': op, 'payload': payload})
+            return cluster, await asyncio.wait_for(future, self.timeout)
+        except (asyncio.TimeoutError, ConnectionError):
+            return cluster, None
+        finally:
+            del self._waiting[key]
+
+    async def _fan_out(self, writer: asyncio.StreamWriter, message: dict):
+        results = await asyncio.gather(*(self._ask(cluster, client, message['op'], message.get('payload'))
+                                         for cluster, client in list(self._clients.items())))
+        try:
+            await _send(writer, {'reply': message['id'], 'result': {str(cluster): result for cluster, result in results}})
+        except ConnectionError:
+            pass
+
+
+class IPCClient:
+    """Runs in every cluster process; answers requests with the registered
+    handlers and can broadcast a request to all clusters."""
+
+    def __init__(self, cluster: int, secret: str, *, host: str = '127.0.0.1', port: int, timeout: float = 10.0):
+        self.cluster = cluster
+        self.secret = secret
+        self.host = host
+        self.port = port
+        self.timeout = timeout
+
+        self._handlers = {}
+        self._writer = None
+        self._waiting = {}
+        self._ids = itertools.count()
+
+    def handler(self, op: str):
+        def decorator(func):
+            self._handlers[op] = func
+            return func
+
+        return decorator
+
+    @property
+    def connected(self):
+        return self._writer is not None
+
+    async def run(self):
+        """Keeps a connection to the hub open, reconnecting if it drops."""
+        while True:
+            try:
+                reader, self._writer = await asyncio.open_connection(self.host, self.port)
+                await _send(self._writer, {'cluster': self.cluster, 'secret': self.secret})
+                await self._read(reader)
+            except (ConnectionError, OSError):
+                pass
+            finally:
+                self._writer = None
+                for future in self._waiting.values():
+                    if not future.done():
+                        future.set_exception(IPCError('Lost the connection to the launcher.'))
+
+            await asyncio.sleep(5)
+
+    async def _read(self, reader: asyncio.StreamReader):
+        while True:
+            message = await _receive(reader)
+            if message is None:
+                return
+
+            if 'reply' in message:
+                future = self._waiting.get(message['reply'])
+                if future is not None and not future.done():
+                    future.set_result(message['result'])
+            else:
+                asyncio.ensure_future(self._answer(message))
+
+    async def _answer(self, message: dict):
+        handler = self._handlers.get(message['op'])
+        result = None
+        if handler is not None:
+            result = handler(message.get('payload'))
+            if asyncio.iscoroutine(result):
+                result = await result
+
+        if self._writer is not None:
+            await _send(self._writer, {'reply': message['id'], 'result': result})
+
+    async def broadcast(self, op: str, payload=None):
+        """Returns `{cluster: result}` from every connected cluster."""
+        if self._writer is None:
+            raise IPCError('Not connected to the launcher.')
+
+        key = next(self._ids)
+        future = self._waiting[key] = asyncio.get_event_loop().create_future()
+        try:
+            await _send(self._writer, {'id': key, 'op': op, 'payload': payload})
+            return await asyncio.wait_for(future, self.timeout)
+        except asyncio.TimeoutError:
+            raise IPCError('The launcher did not answer in time.')
+        finally:
+            del self._waiting[key]
@@ -1,15 +1,71 @@
-from flask import Flask
-from threading import Thread
+import math
+import os
 
-app = Flask('')
+from aiohttp import web
 
-@app.route('/')
-def home():
-    return "Krulcifer is Active!"
 
-def run():
-  app.run(host='0.0.0.0',port=8080)
+class HealthServer:
+    """Small HTTP server on the bot's own event loop.
 
-def keep_alive():
-    t = Thread(target=run)
-    t.start()
\ No newline at end of file
+    `/` keeps answering the uptime pinger, `/live` and `/ready` report the
+    gateway connection and `/metrics` renders every registered collector in
+    the Prometheus text format.
+    """
+
+    def __init__(self, bot, *, host: str = '0.0.0.0', port: int = 8080, max_latency: float = 10.0):
+        self.bot = bot
+        self.host = host
+        self.port = port
+        self.max_latency = max_latency
+        self.collectors = []
+        self._runner = None
+
+        self.app = web.Application()
+        self.app.router.add_get('/', self.home)
+        self.app.router.add_get('/live', self.live)
+        self.app.router.add_get('/ready', self.ready)
+        self.app.router.add_get('/metrics', self.metrics)
+
+    async def start(self):
+        self._runner = web.AppRunner(self.app, access_log=None)
+        await self._runner.setup()
+        await web.TCPSite(self._runner, self.host, self.port).start()
+
+    async def close(self):
+        if self._runner is not None:
+            await self._runner.cleanup()
+            self._runner = None
+
+    async def home(self, request: web.Request):
+        return web.Response(text='Krulcifer is Active!')
+
+    async def live(self, request: web.Request):
+        if self.bot.is_closed():
+            return web.Response(status=503, text='closed')
+
+        return web.Response(text='ok')
+
+    async def ready(self, request: web.Request):
+        latency = self.bot.latency
+        if not self.bot.is_ready() or self.bot.is_closed() or not math.isfinite(latency):
+            return web.Response(status=503, text='not connected')
+        if latency > self.max_latency:
+            return web.Response(status=503, text='gateway latency {:.1f}s'.format(latency))
+
+        return web.Response(text='ok')
+
+    async def metrics(self, request: web.Request):
+        lines = []
+        for collect in self.collectors:
+            lines.extend(collect())
+
+        return web.Response(text='\n'.join(lines) + '\n', content_type='text/plain', charset='utf-8',
+                            headers={'X-Content-Type-Options': 'nosniff'})
+
+
+async def keep_alive(bot, *collectors):
+    server = HealthServer(bot, port=int(os.getenv('PORT', 8080)))
+    server.collectors.extend(collectors)
+    await server.start()
+
+    return server
@@ -0,0 +1,115 @@
+"""Runs the bot as several cluster processes, each owning a range of shards.
+
+    python launcher.py [--clusters N] [--shards N]
+
+Every cluster is a regular `main.py` process started with SHARD_COUNT,
+SHARD_IDS, CLUSTER_ID, the address of the launcher's IPC hub and its own
+health server PORT, SNAPSHOT_PATH and AUDIO_CACHE_DIR. Crashed clusters are
+restarted with a backoff.
+"""
+import argparse
+import asyncio
+import os
+import secrets
+import signal
+import sys
+
+import aiohttp
+
+from ipc import IPCHub
+
+
+GATEWAY_URL = 'https://discord.com/api/v8/gateway/bot'
+
+
+async def recommended_shards(token: str):
+    headers = {'Authorization': 'Bot ' + token}
+    async with aiohttp.ClientSession() as session:
+        async with session.get(GATEWAY_URL, headers=headers) as response:
+            response.raise_for_status()
+            return (await response.json())['shards']
+
+
+def shard_ranges(shards: int, clusters: int):
+    clusters = max(1, min(clusters, shards))
+    size, extra = divmod(shards, clusters)
+    start = 0
+    for cluster in range(clusters):
+        stop = start + size + (cluster < extra)
+        yield list(range(start, stop))
+        start = stop
+
+
+async def supervise(cluster: int, env: dict, stopping: asyncio.Event):
+    here = os.path.dirname(os.path.abspath(__file__))
+    backoff = 1
+    while not stopping.is_set():
+        process = await asyncio.create_subprocess_exec(sys.executable, os.path.join(here, 'main.py'), cwd=here, env=env)
+        print('Cluster {} started (pid {}, shards {})'.format(cluster, process.pid, env['SHARD_IDS']))
+
+        waiter = asyncio.ensure_future(process.wait())
+        stopper = asyncio.ensure_future(stopping.wait())
+        await asyncio.wait((waiter, stopper), return_when=asyncio.FIRST_COMPLETED)
+        stopper.cancel()
+
+        if stopping.is_set():
+            process.terminate()
+            await waiter
+            return
+
+        print('Cluster {} exited with {}, restarting in {}s'.format(cluster, waiter.result(), backoff))
+        try:
+            await asyncio.wait_for(stopping.wait(), backoff)
+        except asyncio.TimeoutError:
+            pass
+        backoff = min(backoff * 2, 60)
+
+
+async def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--clusters', type=int, default=os.cpu_count() or 1)
+    parser.add_argument('--shards', type=int, default=int(os.getenv('SHARD_COUNT', 0)) or None,
+                        help='total shard count (defaults to what Discord recommends)')
+    args = parser.parse_args()
+
+    token = os.getenv('TOKEN')
+    if not token:
+        parser.error('the TOKEN environment variable is not set')
+    shards = args.shards or await recommended_shards(token)
+
+    secret = secrets.token_hex(16)
+    hub = IPCHub(secret)
+    await hub.start()
+
+    stopping = asyncio.Event()
+    loop = asyncio.get_event_loop()
+    for sig in (signal.SIGINT, signal.SIGTERM):
+        loop.add_signal_handler(sig, stopping.set)
+
+    base_port = int(os.getenv('PORT', 8080))
+    supervisors = []
+    for cluster, shard_ids in enumerate(shard_ranges(shards, args.clusters)):
+        env = dict(os.environ,
+                   SHARD_COUNT=str(shards),
+                   SHARD_IDS=','.join(map(str, shard_ids)),
+                   CLUSTER_ID=str(cluster),
+                   PORT=str(base_port + cluster),
+                   IPC_PORT=str(hub.port),
+                   IPC_SECRET=secret)
+        if os.getenv('SNAPSHOT_PATH'):
+            # Clusters writing one sqlite file would keep waiting on its lock.
+            root, ext = os.path.splitext(os.getenv('SNAPSHOT_PATH'))
+            env['SNAPSHOT_PATH'] = '{}-{}{}'.format(root, cluster, ext)
+        if os.getenv('AUDIO_CACHE_DIR'):
+            # A cache only accounts for and cleans up its own directory, so
+            # every cluster gets one and a share of the size budget.
+            env['AUDIO_CACHE_DIR'] = os.path.join(os.getenv('AUDIO_CACHE_DIR'), 'cluster-{}'.format(cluster))
+            env['AUDIO_CACHE_BYTES'] = str(int(os.getenv('AUDIO_CACHE_BYTES', 2 * 1024 ** 3)) // args.clusters)
+        supervisors.append(supervise(cluster, env, stopping))
+
+    await asyncio.gather(*supervisors)
+    await hub.close()
+
+
+if __name__ == '__main__':
+    asyncio.get_event_loop().run_until_complete(main())
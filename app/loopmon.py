@@ -0,0 +1,112 @@
+import asyncio
+import collections
+import sys
+import threading
+import time
+import traceback
+import weakref
+
+
+class Stall:
+    __slots__ = ('started', 'duration', 'task', 'label', 'stack')
+
+    def __init__(self, started: float, task: str, label: str, stack: list):
+        self.started = started
+        self.duration = None
+        self.task = task
+        self.label = label
+        self.stack = stack
+
+
+class LoopMonitor:
+    """Measures event loop lag and records what was running during stalls.
+
+    A callback on the loop re-arms itself every `interval` seconds and
+    records how late it ran. A watchdog thread notices when that callback is
+    more than `threshold` seconds overdue and samples the loop thread's
+    stack while it is still blocked, together with the running task and the
+    command it was labelled with. Finished stalls go to a ring buffer.
+    """
+
+    def __init__(self, *, interval: float = 0.1, threshold: float = 0.1, size: int = 100, depth: int = 8):
+        self.interval = interval
+        self.threshold = threshold
+        self.depth = depth
+
+        self.stalls = collections.deque(maxlen=size)
+        self.lags = collections.deque(maxlen=int(60 / interval))
+        self.max_lag = 0.0
+
+        self._labels = weakref.WeakKeyDictionary()
+        self._loop = None
+        self._thread_id = None
+        self._due = None
+        self._sampled = None
+        self._stopped = threading.Event()
+
+    def start(self, loop: asyncio.AbstractEventLoop = None):
+        """Must be called from the loop's own thread."""
+        self._loop = loop or asyncio.get_event_loop()
+        self._thread_id = threading.get_ident()
+        self._due = time.perf_counter() + self.interval
+        self._loop.call_later(self.interval, self._tick)
+        threading.Thread(target=self._watch, name='loop-monitor', daemon=True).start()
+
+    def stop(self):
+        self._stopped.set()
+
+    def label(self, name: str, task: asyncio.Task = None):
+        """Names the current task (e.g. after the command it runs) in stall reports."""
+        task = task or asyncio.current_task()
+        if task is not None:
+            self._labels[task] = name
+
+    def _tick(self):
+        now = time.perf_counter()
+        lag = max(now - self._due, 0.0)
+        self.lags.append(lag)
+        self.max_lag = max(self.max_lag, lag)
+
+        stall, self._sampled = self._sampled, None
+        if stall is not None:
+            stall.duration = lag
+            self.stalls.append(stall)
+
+        if not self._stopped.is_set():
+            self._due = now + self.interval
+            self._loop.call_later(self.interval, self._tick)
+
+    def _watch(self):
+        while not self._stopped.wait(self.threshold / 2):
+            due = self._due
+            if self._sampled is not None or time.perf_counter() - due < self.threshold:
+                continue
+
+            frame = sys._current_frames().get(self._thread_id)
+            stack = traceback.format_stack(frame)[-self.depth:] if frame is not None else []
+            task = asyncio.current_task(self._loop)
+
+            name = label = None
+            if task is not None:
+                coro = task.get_coro()
+                name = getattr(coro, '__qualname__', repr(coro))
+                label = self._labels.get(task)
+
+            # Only keep the sample if the loop hasn't caught up meanwhile.
+            if self._due == due:
+                self._sampled = Stall(time.time(), name, label, stack)
+
+    def percentile(self, q: float):
+        if not self.lags:
+            return 0.0
+
+        lags = sorted(self.lags)
+        return lags[min(int(q * len(lags)), len(lags) - 1)]
+
+    def stats(self):
+        return {
+            'p50': self.percentile(0.5),
+            'p99': self.percentile(0.99),
+            'max': self.max_lag,
+            'stalls': len(self.stalls),
+        }
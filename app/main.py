@@ -1,20 +1,42 @@
 import asyncio
+import collections
 import functools
-import itertools
 import math
 import random
 import os
+import sys
 import time
-# import pandas as pd
 
 import discord
-import youtube_dl
 from async_timeout import timeout
 from discord.ext import commands
-from keep_alive import keep_alive
-
-
-youtube_dl.utils.bug_reports_message = lambda: ''
+from admission import AdmissionController
+from audio_cache import AudioCache, MmapOpusAudio
+from chunked import ChunkedList
+from extraction import EXTRACTION_SECONDS, ExtractionBusy, ExtractionEngine, ExtractionError
+from ipc import IPCClient, IPCError
+from loopmon import LoopMonitor
+import metrics
+from moderation import ModerationEngine
+from radio import RadioHub, parse_stations
+from responses import ResponseScheduler
+from search_index import TrackIndex
+from snapshot import RESTORE_SECONDS, QueueSnapshots
+from startup import StartupPhases
+import tracing
+from ytdl_cache import MetadataCache, SingleFlight, normalize_query
+
+
+STARTED_AT = time.monotonic()
+
+startup = StartupPhases()
+startup.mark('imports')
+
+# With FAST_STARTUP set the bot connects to the gateway first, and the web
+# server, the extractor workers and the search index are started in the
+# background once it is ready. youtube_dl is only ever imported by the
+# extractor workers.
+FAST_STARTUP = bool(os.getenv('FAST_STARTUP'))
 
 
 class VoiceError(Exception):
@@ -25,7 +47,19 @@ class YTDLError(Exception):
     pass
 
 
-class YTDLSource(discord.PCMVolumeTransformer):
+class YTDLBusy(YTDLError):
+    def __init__(self, message: str, guild_id: int):
+        super().__init__(message)
+        self.guild_id = guild_id
+
+
+class Refused(commands.CommandError):
+    def __init__(self, message: str, refusal):
+        super().__init__(message)
+        self.refusal = refusal
+
+
+class YTDLSource(discord.AudioSource):
     YTDL_OPTIONS = {
         'format': 'bestaudio/best',
         'extractaudio': True,
@@ -47,40 +81,350 @@ class YTDLSource(discord.PCMVolumeTransformer):
         'options': '-vn',
     }
 
-    ytdl = youtube_dl.YoutubeDL(YTDL_OPTIONS)
+    # 'pcm' decodes in FFmpeg and scales and encodes every frame in Python;
+    # 'opus' has FFmpeg apply the volume and encode, or copy the stream
+    # untouched when it is already Opus and the volume is 100%.
+    AUDIO_MODE = os.getenv('AUDIO_MODE', 'opus')
+    OPUS_BITRATE = int(os.getenv('OPUS_BITRATE', 128))
+
+    UNAVAILABLE_TITLES = ('[Deleted video]', '[Private video]')
+    # Playlist entries fetched per extraction job after the first one.
+    PLAYLIST_PAGE = int(os.getenv('PLAYLIST_PAGE', 250))
+
+    # Audio kbps of the formats picked for playback and of the best format
+    # on offer, summed over every stream started.
+    selected_kbps = 0
+    best_kbps = 0
+    selected_codecs = collections.Counter()
+
+    extractor = ExtractionEngine(
+        YTDL_OPTIONS,
+        workers=int(os.getenv('YTDL_WORKERS', 2)),
+        mode=os.getenv('YTDL_EXECUTOR', 'process'),
+        max_pending=int(os.getenv('YTDL_MAX_PENDING', 8)))
+    cache = MetadataCache(
+        maxsize=int(os.getenv('YTDL_CACHE_SIZE', 512)),
+        ttl=float(os.getenv('YTDL_CACHE_TTL', 24 * 3600)),
+        stream_ttl=float(os.getenv('YTDL_STREAM_TTL', 3600)),
+        path=os.getenv('YTDL_CACHE_PATH'))
+    audio_cache = AudioCache(
+        os.getenv('AUDIO_CACHE_DIR'),
+        max_bytes=int(os.getenv('AUDIO_CACHE_BYTES', 2 * 1024 ** 3)),
+        admit_after=int(os.getenv('AUDIO_CACHE_ADMIT', 3)),
+        bitrate=OPUS_BITRATE) if os.getenv('AUDIO_CACHE_DIR') else None
+    search_index = TrackIndex(maxsize=int(os.getenv('SEARCH_INDEX_SIZE', 50000)))
+    # Identical queries and URLs being resolved at the same time, from any
+    # guild, share one resolution.
+    flights = SingleFlight()
+
+    def __init__(self, *, data: dict, volume: float = 0.5, mode: str = None, path: str = None,
+                 position: float = 0.0, fade: float = 0.0, bitrate: int = None):
+        self.mode = mode or self.AUDIO_MODE
+        self.path = path
+        self.fade = fade
+        self._volume = max(volume, 0.0)
+        self._reopen = False
+        self._seek = None
+        self._offset = position
+        self._frames = 0
+        self._buffer = collections.deque()
+        # Called once, on the player thread, when the first frame is read.
+        self.on_first_frame = None
 
-    def __init__(self, ctx: commands.Context, source: discord.FFmpegPCMAudio, *, data: dict, volume: float = 0.5):
-        super().__init__(source, volume)
-
-        self.requester = ctx.author
-        self.channel = ctx.channel
         self.data = data
 
         self.uploader = data.get('uploader')
         self.uploader_url = data.get('uploader_url')
         date = data.get('upload_date')
-        self.upload_date = date[6:8] + '.' + date[4:6] + '.' + date[0:4]
+        self.upload_date = date[6:8] + '.' + date[4:6] + '.' + date[0:4] if date else None
         self.title = data.get('title')
         self.thumbnail = data.get('thumbnail')
         self.description = data.get('description')
-        self.duration = self.parse_duration(int(data.get('duration')))
+        self.length = int(data.get('duration') or 0)
+        self.duration = self.parse_duration(self.length)
         self.tags = data.get('tags')
         self.url = data.get('webpage_url')
         self.views = data.get('view_count')
         self.likes = data.get('like_count')
         self.dislikes = data.get('dislike_count')
         self.stream_url = data.get('url')
+        self.codec = data.get('acodec')
+        self.bitrate = self.OPUS_BITRATE
+        if bitrate and path is None:
+            self._select_format(bitrate)
+
+        self.original = self._open(position)
 
     def __str__(self):
         return '**{0.title}** by **{0.uploader}**'.format(self)
 
+    def _select_format(self, kbps: int):
+        """Streams the smallest audio-only format that still meets `kbps`,
+        preferring Opus since it can be passed through without decoding,
+        and encodes at no more than `kbps`."""
+        formats = self.data.get('audio_formats')
+        if not formats:
+            return
+
+        enough = [f for f in formats if f['abr'] >= kbps * 0.9]
+        if enough:
+            chosen = min(enough, key=lambda f: (f['acodec'] != 'opus', f['abr']))
+        else:
+            chosen = max(formats, key=lambda f: f['abr'])
+
+        self.stream_url, self.codec = chosen['url'], chosen['acodec']
+        self.bitrate = min(self.OPUS_BITRATE, kbps)
+
+        cls = type(self)
+        cls.selected_kbps += chosen['abr']
+        cls.best_kbps += max(f['abr'] for f in formats)
+        cls.selected_codecs[chosen['acodec']] += 1
+
+    def _filters(self, position: float):
+        filters = []
+        if self.fade and not position:
+            filters.append('afade=t=in:d={:.2f}'.format(self.fade))
+        if self.fade and self.length > position + self.fade:
+            # Timestamps restart at zero after an input-side seek.
+            filters.append('afade=t=out:st={:.2f}:d={:.2f}'.format(self.length - position - self.fade, self.fade))
+
+        return filters
+
+    def _open(self, position: float = 0.0):
+        filters = self._filters(position)
+        if self.path is not None:
+            # Tracks in the audio cache are already Opus on local disk.
+            if self.mode != 'pcm' and self._volume == 1.0 and not filters:
+                return MmapOpusAudio(self.path, position=position)
+
+            stream, codec, before_options = self.path, 'opus', ''
+        else:
+            stream, codec, before_options = self.stream_url, self.codec, self.FFMPEG_OPTIONS['before_options']
+
+        if position:
+            before_options = '-ss {:.2f} {}'.format(position, before_options)
+        options = self.FFMPEG_OPTIONS['options']
+
+        if self.mode == 'pcm':
+            if filters:
+                options = '{} -filter:a {}'.format(options, ','.join(filters))
+            return discord.PCMVolumeTransformer(
+                discord.FFmpegPCMAudio(stream, before_options=before_options, options=options),
+                min(self._volume, 2.0))
+
+        if self._volume == 1.0 and codec == 'opus' and not filters:
+            # discord.py only passes the stream through for 'opus'/'libopus';
+            # anything else, 'copy' included, is re-encoded with libopus.
+            return discord.FFmpegOpusAudio(stream, codec='opus', before_options=before_options, options=options)
+
+        filters.insert(0, 'volume={:.2f}'.format(self._volume))
+        return discord.FFmpegOpusAudio(stream, bitrate=self.bitrate, before_options=before_options,
+                                       options='{} -filter:a {}'.format(options, ','.join(filters)))
+
+    @property
+    def volume(self):
+        return self._volume
+
+    @volume.setter
+    def volume(self, value: float):
+        value = max(value, 0.0)
+        if value == self._volume:
+            return
+
+        self._volume = value
+        if self.mode == 'pcm':
+            self.original.volume = min(value, 2.0)
+        else:
+            # The volume is baked into the FFmpeg filter graph, so FFmpeg is
+            # restarted at the current position on the player thread.
+            self._reopen = True
+
+    @property
+    def position(self):
+        return self._offset + self._frames * discord.opus.Encoder.FRAME_LENGTH / 1000
+
+    def seek(self, position: float):
+        """Restarts FFmpeg at `position` seconds on the player thread; the
+        seek happens on the input side, so nothing before it is fetched."""
+        self._seek = max(position, 0.0)
+        self._reopen = True
+
+    def read(self):
+        if self._reopen:
+            self._reopen = False
+            position, self._seek = self.position if self._seek is None else self._seek, None
+            original, self.original = self.original, self._open(position)
+            original.cleanup()
+            self._offset, self._frames = position, 0
+            self._buffer.clear()
+
+        data = self._buffer.popleft() if self._buffer else self.original.read()
+        if data:
+            self._frames += 1
+            if self.on_first_frame is not None:
+                callback, self.on_first_frame = self.on_first_frame, None
+                callback()
+
+        return data
+
+    def prebuffer(self, seconds: float):
+        """Reads the first `seconds` of audio ahead of playback. Blocks, so
+        it runs in an executor."""
+        buffer = collections.deque()
+        for _ in range(int(seconds * 1000 / discord.opus.Encoder.FRAME_LENGTH)):
+            data = self.original.read()
+            if not data:
+                break
+            buffer.append(data)
+        self._buffer = buffer
+
+    def is_opus(self):
+        return self.original.is_opus()
+
+    @property
+    def ffmpeg_running(self):
+        original = getattr(self.original, 'original', self.original)
+        process = getattr(original, '_process', None)
+        return process is not None and process.poll() is None
+
+    def cleanup(self):
+        # __del__ calls this even when _open failed in __init__.
+        original = getattr(self, 'original', None)
+        if original is not None:
+            original.cleanup()
+
+    @classmethod
+    async def create_track(cls, ctx: commands.Context, search: str):
+        guild_id = ctx.guild.id if ctx.guild else None
+        info = await cls.resolve(search, guild_id=guild_id, fresh=False)
+
+        return Track.from_info(info, requester_id=ctx.author.id, channel_id=ctx.channel.id)
+
+    @classmethod
+    async def from_track(cls, track: 'Track', *, guild_id: int = None, volume: float = 0.5, position: float = 0.0,
+                         fade: float = 0.0, bitrate: int = None, record: bool = True):
+        """Opens `track`, from the audio cache if it holds it. With `record`
+        a network stream counts as a play towards caching it."""
+        path = cls.audio_cache.lookup(track.id) if cls.audio_cache is not None and track.id else None
+        if path is not None:
+            # Playing from disk only needs the metadata, not a live stream URL.
+            info = await cls.resolve(track.url, guild_id=guild_id, fresh=False)
+            return cls(data=info, volume=volume, path=path, position=position, fade=fade)
+
+        info = await cls.refresh(track.url, guild_id=guild_id)
+        if record and cls.audio_cache is not None:
+            cls.audio_cache.record_play(track.id, info)
+
+        with tracing.span('ffmpeg'):
+            return cls(data=info, volume=volume, position=position, fade=fade, bitrate=bitrate)
+
+    @classmethod
+    async def resolve(cls, search: str, *, guild_id: int = None, fresh: bool = True):
+        """Returns the info dict for `search`, from the cache when possible.
+
+        With `fresh=False` a cached entry whose stream URL has expired is good
+        enough, which is all that enqueueing needs. The returned dict may be
+        shared with other callers and must not be modified.
+        """
+        cached = await cls.cache.get(search)
+        if cached is not None and (not fresh or cached.fresh):
+            return cached.info
+
+        return await cls._shared(('search', normalize_query(search), fresh), cls._resolve, search,
+                                 guild_id=guild_id, fresh=fresh, cached=cached)
+
+    @classmethod
+    async def _resolve(cls, search: str, *, guild_id: int = None, fresh: bool = True, cached=None):
+        # `cached` is what resolve() found for `search`, so it's looked up once.
+        if cached is not None:
+            webpage_url = cached.info['webpage_url']
+        else:
+            # A query that clearly names a track played before skips the
+            # YouTube search.
+            webpage_url = cls.search_index.match(search) or await cls._search(search, guild_id=guild_id)
+            cached = await cls.cache.get(webpage_url)
+            if cached is not None and (not fresh or cached.fresh):
+                cls.cache.alias(search, webpage_url)
+                return cached.info
+
+        info = await cls._fetch(webpage_url, guild_id=guild_id)
+        cls.cache.put(info, search)
+        cls.search_index.add(info)
+
+        return info
+
+    @classmethod
+    async def refresh(cls, webpage_url: str, *, guild_id: int = None):
+        cached = await cls.cache.get(webpage_url)
+        if cached is not None and cached.fresh:
+            return cached.info
+
+        info = await cls._fetch(webpage_url, guild_id=guild_id)
+        cls.cache.put(info)
+        cls.search_index.add(info)
+
+        return info
+
+    @classmethod
+    async def _fetch(cls, webpage_url: str, *, guild_id: int = None):
+        # Different queries for the same video share its extraction too.
+        return await cls._shared(('video', webpage_url), cls._process, webpage_url, guild_id=guild_id)
+
     @classmethod
-    async def create_source(cls, ctx: commands.Context, search: str, *, loop: asyncio.BaseEventLoop = None):
-        loop = loop or asyncio.get_event_loop()
+    async def _shared(cls, key: tuple, func, *args, guild_id: int = None, **kwargs):
+        """Runs `func` as the single flight for `key`. A full per-guild queue
+        only refuses the guild that started the flight; callers from other
+        guilds run `func` under their own guild instead."""
+        try:
+            return await cls.flights.run(key, func, *args, guild_id=guild_id, **kwargs)
+        except YTDLBusy as e:
+            if e.guild_id == guild_id:
+                raise
+            return await func(*args, guild_id=guild_id, **kwargs)
 
-        partial = functools.partial(
-            cls.ytdl.extract_info, search, download=False, process=False)
-        data = await loop.run_in_executor(None, partial)
+    @classmethod
+    async def iter_playlist(cls, url: str, *, guild_id: int = None, limit: int = None):
+        """Yields flat playlist entries a page at a time, as lists.
+
+        The first page holds a single entry so playback can start right away,
+        the others PLAYLIST_PAGE entries. Every page is an extraction job of
+        its own, so an import never holds a worker for long and other guilds'
+        requests get their turn in between.
+        """
+        start, stop = 0, 1
+        while limit is None or start < limit:
+            if limit is not None:
+                stop = min(stop, limit)
+            data = await cls._extract(url, guild_id=guild_id, process=False, flat=True, start=start, stop=stop)
+            if data is None:
+                raise YTDLError('Couldn\'t fetch `{}`'.format(url))
+
+            if 'entries' not in data:
+                yield [data]
+                return
+
+            yield [entry for entry in data['entries']
+                   if entry and entry.get('title') not in cls.UNAVAILABLE_TITLES]
+
+            if len(data['entries']) < stop - start:
+                return
+            start, stop = stop, stop + cls.PLAYLIST_PAGE
+
+    @classmethod
+    async def _extract(cls, url: str, **kwargs):
+        try:
+            return await cls.extractor.extract(url, **kwargs)
+        except ExtractionBusy as e:
+            if e.guild_id is None:
+                raise YTDLError(str(e))
+            raise YTDLBusy(str(e), e.guild_id)
+        except ExtractionError as e:
+            raise YTDLError(str(e))
+
+    @classmethod
+    async def _search(cls, search: str, *, guild_id: int = None):
+        with tracing.span('search'):
+            data = await cls._extract(search, guild_id=guild_id, process=False, stop=5)
 
         if data is None:
             raise YTDLError(
@@ -99,10 +443,12 @@ class YTDLSource(discord.PCMVolumeTransformer):
                 raise YTDLError(
                     'Couldn\'t find anything that matches `{}`'.format(search))
 
-        webpage_url = process_info['webpage_url']
-        partial = functools.partial(
-            cls.ytdl.extract_info, webpage_url, download=False)
-        processed_info = await loop.run_in_executor(None, partial)
+        return process_info['webpage_url']
+
+    @classmethod
+    async def _process(cls, webpage_url: str, *, guild_id: int = None):
+        with tracing.span('extract'):
+            processed_info = await cls._extract(webpage_url, guild_id=guild_id)
 
         if processed_info is None:
             raise YTDLError('Couldn\'t fetch `{}`'.format(webpage_url))
@@ -118,7 +464,27 @@ class YTDLSource(discord.PCMVolumeTransformer):
                     raise YTDLError(
                         'Couldn\'t retrieve any matches for `{}`'.format(webpage_url))
 
-        return cls(ctx, discord.FFmpegPCMAudio(info['url'], **cls.FFMPEG_OPTIONS), data=info)
+        # `formats` is too big to cache, so keep just what picking an audio
+        # format per voice channel needs.
+        info['audio_formats'] = cls.audio_formats(info)
+
+        return info
+
+    @staticmethod
+    def audio_formats(info: dict):
+        formats = []
+        for f in info.get('formats') or ():
+            if f.get('vcodec') != 'none' or f.get('acodec') in (None, 'none') or not f.get('url'):
+                continue
+
+            formats.append({
+                'format_id': f.get('format_id'),
+                'abr': float(f.get('abr') or f.get('tbr') or 0),
+                'acodec': f['acodec'],
+                'url': f['url'],
+            })
+
+        return formats
 
     @staticmethod
     def parse_duration(duration: int):
@@ -139,20 +505,80 @@ class YTDLSource(discord.PCMVolumeTransformer):
         return ', '.join(duration)
 
 
+class Track:
+    __slots__ = ('id', 'title', 'uploader', 'duration', 'url', 'requester_id', 'channel_id')
+
+    def __init__(self, id: str, title: str, uploader: str, duration: int, url: str, *,
+                 requester_id: int = None, channel_id: int = None):
+        self.id = id
+        self.title = title
+        self.uploader = uploader
+        self.duration = duration
+        self.url = url
+        self.requester_id = requester_id
+        self.channel_id = channel_id
+
+    def __str__(self):
+        return '**{0.title}** by **{0.uploader}**'.format(self)
+
+    def dump(self):
+        return [getattr(self, slot) for slot in self.__slots__]
+
+    @classmethod
+    def load(cls, row: list):
+        id, title, uploader, duration, url, requester_id, channel_id = row
+        return cls(id, title, uploader, duration, url, requester_id=requester_id, channel_id=channel_id)
+
+    @classmethod
+    def from_info(cls, info: dict, **kwargs):
+        return cls(info.get('id'), info.get('title'), info.get('uploader'), int(info.get('duration') or 0),
+                   info['webpage_url'], **kwargs)
+
+    @classmethod
+    def from_entry(cls, entry: dict, **kwargs):
+        # Flat YouTube entries only carry the video id in `url`.
+        if entry.get('ie_key') == 'Youtube' and entry.get('id'):
+            url = 'https://www.youtube.com/watch?v={}'.format(entry['id'])
+        else:
+            url = entry.get('webpage_url') or entry.get('url')
+
+        return cls(entry.get('id'), entry.get('title'), entry.get('uploader'), int(entry.get('duration') or 0),
+                   url, **kwargs)
+
+
 class Song:
-    __slots__ = ('source', 'requester')
+    __slots__ = ('track', 'source', 'position', 'resumes', 'trace')
 
-    def __init__(self, source: YTDLSource):
+    def __init__(self, track: Track, source: YTDLSource = None, *, position: float = 0.0,
+                 trace: tracing.Trace = None):
+        self.track = track
         self.source = source
-        self.requester = source.requester
+        # Where playback starts, for a track restored from a snapshot or
+        # resumed after its stream broke off.
+        self.position = position
+        self.resumes = 0
+        # The sampled @play request this song came from, until it is heard.
+        self.trace = trace
+
+    @property
+    def requester_id(self):
+        return self.track.requester_id
 
     def create_embed(self):
+        if self.source is None:
+            # The stream is still being resolved.
+            return (discord.Embed(title='Starting...', description='```css\n{}\n```'.format(self.track.title),
+                                  color=discord.Color.blurple())
+                    .add_field(name='Duration', value=YTDLSource.parse_duration(self.track.duration) or 'live')
+                    .add_field(name='Requested-by', value='<@{}>'.format(self.requester_id))
+                    .add_field(name='URL', value='[Click]({})'.format(self.track.url)))
+
         embed = (discord.Embed(title='Now Playing!',
                                description='```css\n{0.source.title}\n```'.format(
                                    self),
                                color=discord.Color.blurple())
                  .add_field(name='Duration', value=self.source.duration)
-                 .add_field(name='Requested-by', value=self.requester.mention)
+                 .add_field(name='Requested-by', value='<@{}>'.format(self.requester_id))
                  .add_field(name='Uploader', value='[{0.source.uploader}]({0.source.uploader_url})'.format(self))
                  .add_field(name='URL', value='[Click]({0.source.url})'.format(self))
                  .set_thumbnail(url=self.source.thumbnail))
@@ -161,11 +587,55 @@ class Song:
 
 
 class SongQueue(asyncio.Queue):
-    def __getitem__(self, item):
-        if isinstance(item, slice):
-            return list(itertools.islice(self._queue, item.start, item.stop, item.step))
+    """Queue of Songs that can also be indexed and edited anywhere.
+
+    Backed by a ChunkedList instead of a deque, so paging, @remove and
+    moves stay cheap with playlist-sized queues. Queued video ids are
+    counted, so duplicate checks don't scan the queue.
+    """
+
+    # Bumped on every change, so snapshots can skip untouched queues.
+    version = 0
+
+    def _init(self, maxsize):
+        self._queue = ChunkedList()
+        self._ids = collections.Counter()
+        # Songs queued after another song of the same video.
+        self._duplicates = 0
+        # Where _put() puts the next item; None appends.
+        self._at = None
+
+    def _put(self, item):
+        if self._at is None:
+            self._queue.append(item)
         else:
-            return self._queue[item]
+            self._queue.insert(self._at, item)
+        self._count(item, 1)
+        self.version += 1
+
+    def _get(self):
+        item = self._queue.popleft()
+        self._count(item, -1)
+        self.version += 1
+        return item
+
+    def _count(self, song, delta: int):
+        video_id = song.track.id
+        if video_id is None:
+            return
+
+        count = self._ids[video_id]
+        if delta > 0:
+            self._duplicates += count > 0
+        else:
+            self._duplicates -= count > 1
+        if count + delta > 0:
+            self._ids[video_id] = count + delta
+        else:
+            del self._ids[video_id]
+
+    def __getitem__(self, item):
+        return self._queue[item]
 
     def __iter__(self):
         return self._queue.__iter__()
@@ -173,20 +643,89 @@ class SongQueue(asyncio.Queue):
     def __len__(self):
         return self.qsize()
 
+    def has_track(self, video_id: str):
+        return video_id in self._ids
+
     def clear(self):
         self._queue.clear()
+        self._ids.clear()
+        self._duplicates = 0
+        self.version += 1
 
     def shuffle(self):
-        random.shuffle(self._queue)
+        # Same songs, so the id counts stay as they are.
+        songs = list(self._queue)
+        random.shuffle(songs)
+        self._queue.replace(songs)
+        self.version += 1
 
     def remove(self, index: int):
-        del self._queue[index]
+        self._count(self._queue.pop(index), -1)
+        self.version += 1
+
+    def insert(self, index: int, song):
+        """Like put_nowait(), but puts `song` at `index`."""
+        self._at = index
+        try:
+            self.put_nowait(song)
+        finally:
+            self._at = None
+
+    def move(self, source: int, destination: int):
+        self._queue.move(source, destination)
+        self.version += 1
+
+    def dedupe(self):
+        """Drops every song whose video is already queued earlier; returns how many."""
+        if not self._duplicates:
+            return 0
+
+        seen = set()
+        songs = []
+        for song in self._queue:
+            if song.track.id is None or song.track.id not in seen:
+                seen.add(song.track.id)
+                songs.append(song)
+            else:
+                self._count(song, -1)
+
+        removed = len(self._queue) - len(songs)
+        self._queue.replace(songs)
+        self.version += 1
+
+        return removed
 
 
 class VoiceState:
-    def __init__(self, bot: commands.Bot, ctx: commands.Context):
+    # How many upcoming tracks get their stream URL resolved ahead of time.
+    PREFETCH = int(os.getenv('PREFETCH_TRACKS', 1))
+    # How often one track is resumed after its stream broke off.
+    MAX_RESUMES = int(os.getenv('MAX_RESUMES', 3))
+    # With GAPLESS set, the next track's FFmpeg is started and GAPLESS_BUFFER
+    # seconds of it are read before the current one ends. CROSSFADE fades
+    # tracks out and in over that many seconds.
+    GAPLESS = bool(os.getenv('GAPLESS'))
+    GAPLESS_BUFFER = float(os.getenv('GAPLESS_BUFFER', 3))
+    CROSSFADE = float(os.getenv('CROSSFADE', 0)) if GAPLESS else 0.0
+
+    # Resumed tracks across all guilds, for the metrics.
+    resumes = 0
+
+    def __init__(self, bot: commands.Bot, guild: discord.Guild, channel: discord.abc.Messageable, *, on_idle=None):
         self.bot = bot
-        self._ctx = ctx
+        self.guild = guild
+        self.channel = channel
+        self._on_idle = on_idle
+        self._prefetching = {}
+        self.importing = None
+        self.last_active = time.monotonic()
+        # Set when the state came back from a snapshot, until it plays again.
+        self.restored = False
+        self.skipped = False
+        self._warming = None
+        self._warmed = None
+        # A BroadcastListener while tuned in to a radio station.
+        self.radio = None
 
         self.current = None
         self.voice = None
@@ -195,12 +734,21 @@ class VoiceState:
 
         self._loop = False
         self._volume = 0.5
+        # kbps to stream at, set with @bitrate; None follows the voice channel.
+        self.bitrate = None
         self.skip_votes = set()
 
-        self.audio_player = bot.loop.create_task(self.audio_player_task())
+        # Started on first use, so a state that only served @queue or @now
+        # costs no task.
+        self.audio_player = None
 
-    def __del__(self):
-        self.audio_player.cancel()
+    def start(self):
+        self.last_active = time.monotonic()
+        if self.audio_player is None or self.audio_player.done():
+            # The player outlives the command that starts it, so it must not
+            # inherit that command's trace; it makes each song's current itself.
+            with tracing.use(None):
+                self.audio_player = self.bot.loop.create_task(self.audio_player_task())
 
     @property
     def loop(self):
@@ -217,66 +765,462 @@ class VoiceState:
     @volume.setter
     def volume(self, value: float):
         self._volume = value
+        if self.current and self.current.source:
+            self.current.source.volume = value
 
     @property
     def is_playing(self):
-        return self.voice and self.current
+        return self.voice and (self.current or self.radio)
+
+    @property
+    def target_bitrate(self):
+        """kbps worth streaming: the override, else what the channel carries."""
+        if self.bitrate:
+            return self.bitrate
+
+        channel_bitrate = getattr(self.voice and self.voice.channel, 'bitrate', None)
+        return channel_bitrate // 1000 if channel_bitrate else None
 
     async def audio_player_task(self):
+        resume = False
         while True:
             self.next.clear()
+            self.skipped = False
 
-            if not self.loop:
+            if self.current is None or not (resume or self.loop):
 
                 try:
                     async with timeout(180):
                         self.current = await self.songs.get()
                 except asyncio.TimeoutError:
-                    self.bot.loop.create_task(self.stop())
+                    if self.radio is not None:
+                        continue
+                    self.bot.loop.create_task(self._on_idle(self) if self._on_idle else self.stop())
                     return
 
-            self.current.source.volume = self._volume
+            song = self.current
+            track = song.track
+            channel = self.bot.get_channel(track.channel_id) or self.channel
+            position, song.position = song.position, 0.0
+            source = self._take_warmed(song) if not position else None
+            trace, song.trace = song.trace, None
+            if trace is not None:
+                trace.end('queued')
+            try:
+                with tracing.use(trace), tracing.span('stream'):
+                    source = source or await YTDLSource.from_track(
+                        track, guild_id=self.guild.id, volume=self._volume, position=position, fade=self.CROSSFADE,
+                        bitrate=self.target_bitrate)
+            except Exception as e:
+                if trace is not None:
+                    trace.finish(error=str(e))
+                if not isinstance(e, YTDLError):
+                    # Anything else would end the player with songs still queued.
+                    print('Couldn\'t open {} in guild {}: {!r}'.format(track.url, self.guild.id, e), file=sys.stderr)
+                await channel.send('Ara ara couldn\'t play **{}**: {}'.format(track.title, str(e)))
+                self.current = None
+                continue
+
+            if self.current is not song:
+                # Tuned in to the radio while the stream was resolving.
+                if trace is not None:
+                    trace.finish(error='tuned to radio')
+                source.cleanup()
+                continue
+            song.source = source
+
+            self.prefetch()
+            self.last_active = time.monotonic()
+            if trace is not None:
+                trace.begin('first audio')
+                self.current.source.on_first_frame = functools.partial(self._first_frame, trace)
             self.voice.play(self.current.source, after=self.play_next_song)
-            await self.current.source.channel.send(embed=self.current.create_embed())
+            if self.GAPLESS:
+                self._warming = self.bot.loop.create_task(self._warm_next(self.current))
+            if self.restored:
+                self.restored = False
+                elapsed = time.monotonic() - STARTED_AT
+                RESTORE_SECONDS.observe(elapsed)
+                print('Restored guild {} playing again {:.1f}s after start'.format(self.guild.id, elapsed))
+            if resume:
+                await channel.send('Ara ara the stream dropped, resuming **{}** at {}'.format(
+                    track.title, YTDLSource.parse_duration(int(position)) or 'the start'))
+            else:
+                await channel.send(embed=self.current.create_embed())
 
             await self.next.wait()
+            if self._warming is not None:
+                self._warming.cancel()
+            resume = self._broke_off()
+
+    async def _warm_next(self, song: 'Song'):
+        """Opens the track after `song` shortly before `song` ends and reads
+        its first frames, so the handoff doesn't wait for FFmpeg to spawn,
+        connect and buffer."""
+        source = song.source
+        # Leave time to resolve the stream URL on top of the buffering.
+        lead = self.GAPLESS_BUFFER + 10
+        while source.length and source.length - source.position > lead:
+            await asyncio.sleep(min(source.length - source.position - lead, 5))
+
+        if not source.length or self.loop or not self.songs:
+            return
+
+        upcoming = self.songs[0]
+        try:
+            # Only counted as a play in _take_warmed(), once it is used.
+            warmed = await YTDLSource.from_track(upcoming.track, guild_id=self.guild.id, volume=self._volume,
+                                                 fade=self.CROSSFADE, bitrate=self.target_bitrate, record=False)
+        except YTDLError:
+            # The player reports it when the track comes up.
+            return
+
+        try:
+            await self.bot.loop.run_in_executor(None, warmed.prebuffer, self.GAPLESS_BUFFER)
+        except BaseException:
+            warmed.cleanup()
+            raise
+
+        self.discard_warmed()
+        self._warmed = (upcoming, warmed)
+
+    def _take_warmed(self, song: 'Song'):
+        warmed, self._warmed = self._warmed, None
+        if warmed is None:
+            return None
+        if warmed[0] is not song:
+            warmed[1].cleanup()
+            return None
+
+        source = warmed[1]
+        if YTDLSource.audio_cache is not None and source.path is None:
+            YTDLSource.audio_cache.record_play(song.track.id, source.data)
+        source.volume = self._volume
+        return source
+
+    def discard_warmed(self):
+        """Kills the pre-warmed FFmpeg unless it is still for the next song."""
+        if self._warmed is not None and not (self.songs and self.songs[0] is self._warmed[0]):
+            self._warmed[1].cleanup()
+            self._warmed = None
+
+    def _broke_off(self):
+        """Checks whether the track stopped well before its end without being
+        skipped, e.g. because the stream URL expired or FFmpeg's reconnects
+        gave up, and if so sets it up to resume where it stopped."""
+        song = self.current
+        if self.skipped or not self.voice or song is None or song.source is None:
+            return False
+
+        position = song.source.position
+        if not song.source.length or position > song.source.length - 5 or song.resumes >= self.MAX_RESUMES:
+            return False
+
+        # The cached stream URL is what failed; resolve a new one.
+        YTDLSource.cache.invalidate(song.track.url)
+        song.resumes += 1
+        song.position = position
+        VoiceState.resumes += 1
+
+        return True
+
+    def prefetch(self):
+        for song in self.songs[:self.PREFETCH]:
+            url = song.track.url
+            if url in self._prefetching:
+                continue
+
+            task = self.bot.loop.create_task(YTDLSource.refresh(url, guild_id=self.guild.id))
+            task.add_done_callback(functools.partial(self._prefetched, url))
+            self._prefetching[url] = task
+
+    def _prefetched(self, url: str, task: asyncio.Task):
+        self._prefetching.pop(url, None)
+        if not task.cancelled():
+            # Failures surface again when the track is actually played.
+            task.exception()
+
+    def _first_frame(self, trace: tracing.Trace):
+        # Runs on the player thread.
+        trace.end('first audio')
+        self.bot.loop.call_soon_threadsafe(trace.finish)
 
     def play_next_song(self, error=None):
+        # Runs on the player thread. Raising here used to leave the player
+        # waiting forever; a failed stream is resumed instead.
         if error:
-            raise VoiceError(str(error))
+            print('Player error in guild {}: {}'.format(self.guild.id, error), file=sys.stderr)
 
-        self.next.set()
+        self.bot.loop.call_soon_threadsafe(self.next.set)
 
     def skip(self):
         self.skip_votes.clear()
 
-        if self.is_playing:
+        if self.radio is not None:
+            self.tune_out()
+        elif self.is_playing:
+            self.skipped = True
             self.voice.stop()
+        if self._warming is not None:
+            self._warming.cancel()
+
+    def seek(self, position: float):
+        self.current.source.seek(position)
+
+    def tune(self, listener):
+        """Replaces the queue and the current song with a radio station."""
+        self.songs.clear()
+        self.discard_warmed()
+        self.skip()
+        self.tune_out()
+        # Otherwise the player would replay the old song (or keep it shown
+        # as current) over the station.
+        self.current = None
+        self.loop = False
+
+        self.radio = listener
+        self.voice.play(listener)
+
+    def tune_out(self):
+        listener, self.radio = self.radio, None
+        if listener is not None:
+            if self.voice and self.voice.source is listener:
+                self.voice.stop()
+            listener.cleanup()
 
     async def stop(self):
         self.songs.clear()
+        if self.importing is not None:
+            self.importing.cancel()
+        for task in list(self._prefetching.values()):
+            task.cancel()
+        if self._warming is not None:
+            self._warming.cancel()
+        self.discard_warmed()
+        self.tune_out()
 
         if self.voice:
             await self.voice.disconnect()
             self.voice = None
 
+    async def close(self):
+        await self.stop()
+        if self.audio_player is not None and self.audio_player is not asyncio.current_task():
+            self.audio_player.cancel()
+        self.current = None
+
+    @property
+    def idle(self):
+        return not self.voice and not self.songs and (self.audio_player is None or self.audio_player.done())
+
+    def live_tasks(self):
+        tasks = len(self._prefetching)
+        if self.audio_player is not None and not self.audio_player.done():
+            tasks += 1
+        if self.importing is not None and not self.importing.done():
+            tasks += 1
+        if self._warming is not None and not self._warming.done():
+            tasks += 1
+
+        return tasks
+
+    def fingerprint(self):
+        """Changes whenever anything but the playback position does."""
+        return (self.songs.version, id(self.current), self._volume, self._loop,
+                self.voice.channel.id if self.voice else None)
+
+    def snapshot(self):
+        return {
+            'voice_channel_id': self.voice.channel.id if self.voice else None,
+            'text_channel_id': getattr(self.channel, 'id', None),
+            'volume': self._volume,
+            'loop': self._loop,
+            'current': self.current.track.dump() if self.current else None,
+            'position': self.position,
+            'tracks': [song.track.dump() for song in self.songs],
+        }
+
+    @property
+    def position(self):
+        if self.current is None:
+            return 0.0
+        if self.current.source is None:
+            return self.current.position
+
+        return round(self.current.source.position, 1)
+
+    def memory(self):
+        """Rough size in bytes of the state and everything queued in it."""
+        size = sys.getsizeof(self) + sys.getsizeof(self.__dict__) + sys.getsizeof(self.songs._queue)
+        for song in self.songs:
+            size += sys.getsizeof(song) + sys.getsizeof(song.track)
+            size += sum(sys.getsizeof(getattr(song.track, slot)) for slot in Track.__slots__)
+
+        return size
+
 
 class Music(commands.Cog):
+    # Most tracks a single guild can have queued through @playlist.
+    PLAYLIST_LIMIT = int(os.getenv('PLAYLIST_LIMIT', 5000))
+    # Most tracks a single guild can have queued at all.
+    MAX_QUEUE = int(os.getenv('MAX_QUEUE', 5000))
+    # Seconds an unused, disconnected VoiceState is kept before eviction.
+    IDLE_TIMEOUT = int(os.getenv('VOICE_STATE_IDLE_TIMEOUT', 300))
+    # Queues are written to SNAPSHOT_PATH this often and restored on startup.
+    SNAPSHOT_INTERVAL = float(os.getenv('SNAPSHOT_INTERVAL', 30))
+    # Voice connections opened at once while restoring.
+    RESTORE_CONCURRENCY = int(os.getenv('RESTORE_CONCURRENCY', 5))
+
+    snapshots = QueueSnapshots(os.getenv('SNAPSHOT_PATH')) if os.getenv('SNAPSHOT_PATH') else None
+    # A TRACE_SAMPLE_RATE share of @play requests is traced from the command
+    # to the first audio frame and appended to TRACE_PATH, if set.
+    tracer = tracing.Tracer(sample_rate=float(os.getenv('TRACE_SAMPLE_RATE', 0.05)), path=os.getenv('TRACE_PATH'),
+                            format=os.getenv('TRACE_FORMAT', 'jsonl'))
+    # @play and @playlist are limited to USER_PLAYS a minute per user and
+    # GUILD_PLAYS a minute per guild, and refused outright while extractions
+    # wait longer than EXTRACTION_MAX_DELAY seconds for a worker.
+    admission = AdmissionController(
+        user_rate=float(os.getenv('USER_PLAYS', 6)) / 60, user_burst=float(os.getenv('USER_PLAYS', 6)),
+        guild_rate=float(os.getenv('GUILD_PLAYS', 30)) / 60, guild_burst=float(os.getenv('GUILD_PLAYS', 30)),
+        max_queue=MAX_QUEUE, max_delay=float(os.getenv('EXTRACTION_MAX_DELAY', 10)),
+        delay=lambda: YTDLSource.extractor.delay())
+    REFUSALS = {
+        'user': 'Ara ara slow down, you can queue again in {}s.',
+        'guild': 'Ara ara this server is queueing too fast, try again in {}s.',
+        'queue': 'Ara ara The queue is full ({} tracks).'.format(MAX_QUEUE),
+        'overload': 'Ara ara Im too busy right now, try again in a moment.',
+    }
+
     def __init__(self, bot: commands.Bot):
         self.bot = bot
         self.voice_states = {}
+        self.evictions = 0
+        self.restores = 0
+        self._restored = False
+        self._sweeper = bot.loop.create_task(self._sweep())
+        if not FAST_STARTUP:
+            self.seed_index()
+        self._snapshotter = bot.loop.create_task(self._snapshot()) if self.snapshots is not None else None
+
+        # RADIO_STATIONS='lofi=<playlist url>;jazz=<url>,<url>' sets up 24/7
+        # stations that every guild tuned in shares one FFmpeg for.
+        stations = parse_stations(os.getenv('RADIO_STATIONS', ''))
+        self.radio = RadioHub(stations, resolve=YTDLSource.refresh, expand=self._expand_station,
+                              ffmpeg_options=YTDLSource.FFMPEG_OPTIONS, bitrate=YTDLSource.OPUS_BITRATE,
+                              loop=bot.loop) if stations else None
+
+    def seed_index(self):
+        # Tracks resolved by earlier runs are searchable again once this is done.
+        return self.bot.loop.run_in_executor(None, lambda: YTDLSource.search_index.extend(YTDLSource.cache.infos()))
+
+    async def _expand_station(self, url: str):
+        return [Track.from_entry(entry).url
+                async for page in YTDLSource.iter_playlist(url, limit=self.PLAYLIST_LIMIT) for entry in page]
 
     def get_voice_state(self, ctx: commands.Context):
         state = self.voice_states.get(ctx.guild.id)
         if not state:
-            state = VoiceState(self.bot, ctx)
+            state = VoiceState(self.bot, ctx.guild, ctx.channel, on_idle=self.evict)
             self.voice_states[ctx.guild.id] = state
+        state.last_active = time.monotonic()
 
         return state
 
+    async def evict(self, state: VoiceState, *, force: bool = False):
+        guild_id = state.guild.id
+        if self.voice_states.get(guild_id) is state:
+            if state.songs and not force:
+                # Something was queued while the player was timing out.
+                state.start()
+                return
+
+            del self.voice_states[guild_id]
+            self.evictions += 1
+
+        await state.close()
+
+    async def _sweep(self):
+        while True:
+            await asyncio.sleep(60)
+            now = time.monotonic()
+            for state in list(self.voice_states.values()):
+                if state.idle and now - state.last_active > self.IDLE_TIMEOUT:
+                    await self.evict(state)
+
+    async def _snapshot(self):
+        await self.bot.wait_until_ready()
+        while True:
+            await asyncio.sleep(self.SNAPSHOT_INTERVAL)
+            try:
+                await self.save_snapshots()
+            except Exception as e:
+                # Unsaved guilds keep their old fingerprint and are retried next time.
+                print('Couldn\'t save queue snapshots: {!r}'.format(e), file=sys.stderr)
+
+    async def save_snapshots(self):
+        # Only guilds with something to come back to are kept.
+        await self.snapshots.save(
+            (guild_id, state.fingerprint(), state.snapshot, state.position)
+            for guild_id, state in list(self.voice_states.items())
+            if state.voice and (state.current or state.songs))
+
+    @commands.Cog.listener()
+    async def on_ready(self):
+        # on_ready fires again after reconnects; only restore once.
+        if self.snapshots is None or self._restored:
+            return
+        self._restored = True
+
+        snapshots = await self.snapshots.load(guild.id for guild in self.bot.guilds)
+        semaphore = asyncio.Semaphore(self.RESTORE_CONCURRENCY)
+        await asyncio.gather(*(self._restore(snapshot, semaphore) for snapshot in snapshots))
+
+    async def _restore(self, snapshot: dict, semaphore: asyncio.Semaphore):
+        guild = self.bot.get_guild(snapshot['guild_id'])
+        if guild is None:
+            return
+
+        voice_channel = guild.get_channel(snapshot['voice_channel_id'] or 0)
+        text_channel = self.bot.get_channel(snapshot['text_channel_id'] or 0) or guild.system_channel
+        if voice_channel is None or text_channel is None or guild.id in self.voice_states:
+            return
+
+        state = VoiceState(self.bot, guild, text_channel, on_idle=self.evict)
+        state.volume = snapshot['volume']
+        state.loop = snapshot['loop']
+        # Only the descriptors come back; the player resolves the head track
+        # and prefetches the next one, everything else waits its turn.
+        if snapshot['current']:
+            state.songs.put_nowait(Song(Track.load(snapshot['current']), position=snapshot['position']))
+        for row in snapshot['tracks']:
+            state.songs.put_nowait(Song(Track.load(row)))
+
+        async with semaphore:
+            try:
+                state.voice = await voice_channel.connect()
+            except (discord.ClientException, asyncio.TimeoutError) as e:
+                print('Couldn\'t restore guild {}: {}'.format(guild.id, e))
+                return
+
+        state.restored = True
+        self.voice_states[guild.id] = state
+        self.restores += 1
+        state.start()
+
     def cog_unload(self):
+        self._sweeper.cancel()
+        if self._snapshotter is not None:
+            self._snapshotter.cancel()
         for state in self.voice_states.values():
-            self.bot.loop.create_task(state.stop())
+            self.bot.loop.create_task(state.close())
+        self.voice_states.clear()
+        if self.radio is not None:
+            self.radio.close()
+
+        YTDLSource.extractor.close()
+        if YTDLSource.audio_cache is not None:
+            YTDLSource.audio_cache.close()
+        YTDLSource.cache.close()
 
     def cog_check(self, ctx: commands.Context):
         if not ctx.guild:
@@ -285,10 +1229,23 @@ class Music(commands.Cog):
 
         return True
 
+    def admit(self, ctx: commands.Context):
+        # Called first thing in @play and @playlist, after ensure_voice_state,
+        # so only requests that would otherwise go ahead take tokens.
+        refusal = self.admission.admit(ctx.author.id, ctx.guild.id, queued=len(ctx.voice_state.songs))
+        if refusal is not None:
+            raise Refused(self.REFUSALS[refusal.reason].format(math.ceil(refusal.retry_after)), refusal)
+
     async def cog_before_invoke(self, ctx: commands.Context):
         ctx.voice_state = self.get_voice_state(ctx)
 
     async def cog_command_error(self, ctx: commands.Context, error: commands.CommandError):
+        if isinstance(error, Refused):
+            # Repeated refusals within the retry window go unanswered.
+            if error.refusal.notify:
+                responder.send(ctx.channel, str(error))
+            return
+
         await ctx.send('An error occurred: {}'.format(str(error)))
 
     @commands.command(name='join', invoke_without_subcommand=True)
@@ -300,6 +1257,7 @@ class Music(commands.Cog):
             return
 
         ctx.voice_state.voice = await destination.connect()
+        ctx.voice_state.start()
 
     @commands.command(name='summon')
     @commands.has_permissions(manage_guild=True)
@@ -315,6 +1273,7 @@ class Music(commands.Cog):
             return
 
         ctx.voice_state.voice = await destination.connect()
+        ctx.voice_state.start()
 
     @commands.command(name='leave', aliases=['disconnect'])
     @commands.has_permissions(manage_guild=True)
@@ -323,8 +1282,7 @@ class Music(commands.Cog):
         if not ctx.voice_state.voice:
             return await ctx.send('Ara But you are not connected to any voice channel.')
 
-        await ctx.voice_state.stop()
-        del self.voice_states[ctx.guild.id]
+        await self.evict(ctx.voice_state, force=True)
 
     @commands.command(name='volume')
     async def _volume(self, ctx: commands.Context, *, volume: int):
@@ -338,9 +1296,35 @@ class Music(commands.Cog):
         ctx.voice_state.volume = volume / 100
         await ctx.send('Volume of the player set to {}%'.format(volume))
 
+    @commands.command(name='bitrate')
+    async def _bitrate(self, ctx: commands.Context, *, kbps: str = None):
+
+        state = ctx.voice_state
+        if kbps is None:
+            return await ctx.send('Ara ara streaming at {} kbps{}'.format(
+                state.target_bitrate or YTDLSource.OPUS_BITRATE, '' if state.bitrate else ' (auto)'))
+
+        if kbps.lower() == 'auto':
+            state.bitrate = None
+        elif kbps.isdigit() and 8 <= int(kbps) <= 512:
+            state.bitrate = int(kbps)
+        else:
+            return await ctx.send('Ara ara indicate the bitrate in kbps between 8 and 512, or `auto`')
+
+        await ctx.send('Ara ara tracks from the next one on stream at {} kbps'.format(
+            state.target_bitrate or YTDLSource.OPUS_BITRATE))
+
     @commands.command(name='now', aliases=['current', 'playing'])
     async def _now(self, ctx: commands.Context):
 
+        radio = ctx.voice_state.radio
+        if radio is not None:
+            return await ctx.send('Ara ara tuned in to **{}**, now playing **{}**'.format(
+                radio.broadcast.name, radio.broadcast.title or '...'))
+
+        if ctx.voice_state.current is None:
+            return await ctx.send('Ara ara Im not playing anything right now.')
+
         await ctx.send(embed=ctx.voice_state.current.create_embed())
 
     @commands.command(name='pause')
@@ -360,14 +1344,47 @@ class Music(commands.Cog):
             ctx.voice_state.voice.resume()
             await ctx.message.add_reaction('⏯')
 
+    @commands.command(name='seek')
+    async def _seek(self, ctx: commands.Context, *, timestamp: str):
+
+        current = ctx.voice_state.current
+        if not ctx.voice_state.is_playing or current is None or current.source is None:
+            return await ctx.send('Ara But im not playing any music now')
+
+        try:
+            position = self.parse_timestamp(timestamp)
+        except ValueError:
+            return await ctx.send('Ara ara Give me a time like `90`, `1:30` or `1:02:30`.')
+
+        length = ctx.voice_state.current.source.length
+        if length and position >= length:
+            return await ctx.send('Ara ara This song is only {} long.'.format(ctx.voice_state.current.source.duration))
+
+        ctx.voice_state.seek(position)
+        await ctx.message.add_reaction('⏩')
+
+    @staticmethod
+    def parse_timestamp(timestamp: str):
+        seconds = 0.0
+        for part in timestamp.strip().split(':'):
+            seconds = seconds * 60 + float(part)
+        if seconds < 0:
+            raise ValueError(timestamp)
+
+        return seconds
+
     @commands.command(name='stop')
     @commands.has_permissions(manage_guild=True)
     async def _stop(self, ctx: commands.Context):
 
         ctx.voice_state.songs.clear()
+        ctx.voice_state.discard_warmed()
+        ctx.voice_state.tune_out()
+        if ctx.voice_state.importing is not None:
+            ctx.voice_state.importing.cancel()
 
         if ctx.voice_state.is_playing:
-            ctx.voice_state.voice.stop()
+            ctx.voice_state.skip()
             await ctx.message.add_reaction('⏹')
 
     @commands.command(name='skip')
@@ -377,7 +1394,8 @@ class Music(commands.Cog):
             return await ctx.send('Ara But im not playing any music now')
 
         voter = ctx.message.author
-        if voter == ctx.voice_state.current.requester:
+        # Anyone can skip off the radio, as with @radio off.
+        if ctx.voice_state.radio is not None or voter.id == ctx.voice_state.current.requester_id:
             await ctx.message.add_reaction('⏭')
             ctx.voice_state.skip()
 
@@ -408,7 +1426,7 @@ class Music(commands.Cog):
 
         queue = ''
         for i, song in enumerate(ctx.voice_state.songs[start:end], start=start):
-            queue += '`{0}.` [**{1.source.title}**]({1.source.url})\n'.format(
+            queue += '`{0}.` [**{1.track.title}**]({1.track.url})\n'.format(
                 i + 1, song)
 
         embed = (discord.Embed(description='**{} tracks:**\n\n{}'.format(len(ctx.voice_state.songs), queue))
@@ -422,6 +1440,7 @@ class Music(commands.Cog):
             return await ctx.send('Ara ara The queue is empty.')
 
         ctx.voice_state.songs.shuffle()
+        ctx.voice_state.discard_warmed()
         await ctx.message.add_reaction('👍')
 
     @commands.command(name='remove')
@@ -431,12 +1450,30 @@ class Music(commands.Cog):
             return await ctx.send('Ara ara The queue is empty.')
 
         ctx.voice_state.songs.remove(index - 1)
+        ctx.voice_state.discard_warmed()
+        await ctx.message.add_reaction('👍')
+
+    @commands.command(name='move')
+    async def _move(self, ctx: commands.Context, index: int, destination: int):
+
+        if not 0 < index <= len(ctx.voice_state.songs) or not 0 < destination <= len(ctx.voice_state.songs):
+            return await ctx.send('Ara ara Pick positions between 1 and {}.'.format(len(ctx.voice_state.songs)))
+
+        ctx.voice_state.songs.move(index - 1, destination - 1)
+        ctx.voice_state.discard_warmed()
         await ctx.message.add_reaction('👍')
 
+    @commands.command(name='dedupe')
+    async def _dedupe(self, ctx: commands.Context):
+
+        removed = ctx.voice_state.songs.dedupe()
+        ctx.voice_state.discard_warmed()
+        await ctx.send('Ara ara Removed {} duplicate tracks from the queue.'.format(removed))
+
     @commands.command(name='loop')
     async def _loop(self, ctx: commands.Context):
 
-        if not ctx.voice_state.is_playing:
+        if not ctx.voice_state.is_playing or ctx.voice_state.current is None:
             return await ctx.send('Ara ara Nothing i can play at the moment.')
 
         # Inverse boolean value to loop and unloop.
@@ -446,22 +1483,129 @@ class Music(commands.Cog):
     @commands.command(name='play')
     async def _play(self, ctx: commands.Context, *, search: str):
 
+        self.admit(ctx)
+        trace = self.tracer.start('play', ctx.message.id)
+        with tracing.use(trace):
+            if not ctx.voice_state.voice:
+                with tracing.span('join'):
+                    await ctx.invoke(self._join)
+
+            async with ctx.typing():
+                try:
+                    with tracing.span('resolve'):
+                        track = await YTDLSource.create_track(ctx, search)
+                except YTDLError as e:
+                    if trace is not None:
+                        trace.finish(error=str(e))
+                    await ctx.send('Ara ara error occurred while processing this request: {}'.format(str(e)))
+                else:
+                    song = Song(track, trace=trace)
+                    if trace is not None:
+                        trace.begin('queued')
+
+                    ctx.voice_state.tune_out()
+                    await ctx.voice_state.songs.put(song)
+                    ctx.voice_state.start()
+                    await ctx.send('Ara ara its Enqueued {}'.format(str(track)))
+
+    @commands.command(name='search')
+    async def _search(self, ctx: commands.Context, *, query: str):
+
+        results = YTDLSource.search_index.search(query, limit=5)
+        if not results:
+            return await ctx.send('Ara ara I don\'t know any track like that yet.')
+
+        lines = ['`{}.` [**{}**]({}) by {} ({})'.format(
+            i, track.title, track.url, track.uploader, YTDLSource.parse_duration(track.duration) or 'live')
+            for i, (score, track) in enumerate(results, start=1)]
+        embed = (discord.Embed(description='\n'.join(lines), color=discord.Color.blurple())
+                 .set_footer(text='Play one with @play <url>'))
+        await ctx.send(embed=embed)
+
+    @commands.command(name='radio')
+    async def _radio(self, ctx: commands.Context, *, station: str = None):
+
+        if self.radio is None:
+            return await ctx.send('Ara ara No radio stations are set up.')
+
+        if station is None:
+            running = self.radio.stats()
+            lines = []
+            for name in sorted(self.radio.stations):
+                stats = running.get(name)
+                lines.append('**{}** {}'.format(name, 'off air' if stats is None else '{} listening, now: {}'.format(
+                    stats['listeners'], stats['title'] or '...')))
+            embed = (discord.Embed(title='Radio stations', description='\n'.join(lines), color=discord.Color.blurple())
+                     .set_footer(text='Tune in with @radio <station>, stop with @radio off'))
+            return await ctx.send(embed=embed)
+
+        station = station.casefold()
+        if station == 'off':
+            ctx.voice_state.tune_out()
+            return await ctx.message.add_reaction('👍')
+
+        if station not in self.radio.stations:
+            return await ctx.send('Ara ara There is no station called **{}**.'.format(station))
+
+        await self.ensure_voice_state(ctx)
         if not ctx.voice_state.voice:
             await ctx.invoke(self._join)
 
         async with ctx.typing():
             try:
-                source = await YTDLSource.create_source(ctx, search, loop=self.bot.loop)
-            except YTDLError as e:
-                await ctx.send('Ara ara error occurred while processing this request: {}'.format(str(e)))
-            else:
-                song = Song(source)
+                listener = await self.radio.tune(station)
+            except (ValueError, YTDLError) as e:
+                return await ctx.send('Ara ara couldn\'t tune in to **{}**: {}'.format(station, str(e)))
+
+        ctx.voice_state.tune(listener)
+        await ctx.send('Ara ara Tuned in to **{}**'.format(station))
 
-                await ctx.voice_state.songs.put(song)
-                await ctx.send('Ara ara its Enqueued {}'.format(str(source)))
+    @commands.command(name='playlist', aliases=['pl'])
+    async def _playlist(self, ctx: commands.Context, *, url: str):
+
+        if ctx.voice_state.importing is not None and not ctx.voice_state.importing.done():
+            return await ctx.send('Ara ara Im still queueing the last playlist.')
+
+        self.admit(ctx)
+        if not ctx.voice_state.voice:
+            await ctx.invoke(self._join)
+
+        limit = min(self.PLAYLIST_LIMIT, self.MAX_QUEUE)
+        room = limit - len(ctx.voice_state.songs)
+        if room <= 0:
+            return await ctx.send('Ara ara The queue is full ({} tracks).'.format(limit))
+
+        ctx.voice_state.tune_out()
+        ctx.voice_state.start()
+        message = await ctx.send('Ara ara Fetching the playlist...')
+        ctx.voice_state.importing = self.bot.loop.create_task(self._import_playlist(ctx, url, message, room))
+        ctx.voice_state.importing.add_done_callback(functools.partial(self._imported, ctx.guild.id))
+
+    @staticmethod
+    def _imported(guild_id: int, task: asyncio.Task):
+        # Extraction errors are reported in the channel; anything else only here.
+        if not task.cancelled() and task.exception() is not None:
+            print('Playlist import failed in guild {}: {!r}'.format(guild_id, task.exception()), file=sys.stderr)
+
+    async def _import_playlist(self, ctx: commands.Context, url: str, message: discord.Message, room: int):
+        count = 0
+        try:
+            async for page in YTDLSource.iter_playlist(url, guild_id=ctx.guild.id, limit=room):
+                for entry in page:
+                    track = Track.from_entry(entry, requester_id=ctx.author.id, channel_id=ctx.channel.id)
+                    await ctx.voice_state.songs.put(Song(track))
+                count += len(page)
+
+                await message.edit(content='Ara ara Queueing the playlist... **{}** tracks so far'.format(count))
+        except YTDLError as e:
+            await message.edit(content='Ara ara error occurred while queueing the playlist after **{}** tracks: {}'
+                               .format(count, str(e)))
+        else:
+            await message.edit(content='Ara ara its Enqueued **{}** tracks from the playlist'.format(count))
 
     @_join.before_invoke
     @_play.before_invoke
+    @_playlist.before_invoke
     async def ensure_voice_state(self, ctx: commands.Context):
         if not ctx.author.voice or not ctx.author.voice.channel:
             raise commands.CommandError(
@@ -473,35 +1617,100 @@ class Music(commands.Cog):
                     'Ara Im already in a voice channel.')
 
 
-bot = commands.Bot(command_prefix='@')
+# SHARD_COUNT/SHARD_IDS (set by launcher.py for each cluster) or SHARDED=1
+# switch to AutoShardedBot; every process keeps its own Music.voice_states.
+SHARD_COUNT = int(os.getenv('SHARD_COUNT', 0)) or None
+SHARD_IDS = [int(shard_id) for shard_id in os.getenv('SHARD_IDS', '').split(',') if shard_id]
+CLUSTER_ID = int(os.getenv('CLUSTER_ID', 0))
+
+if SHARD_COUNT or SHARD_IDS or os.getenv('SHARDED'):
+    bot = commands.AutoShardedBot(command_prefix='@', shard_count=SHARD_COUNT, shard_ids=SHARD_IDS or None)
+else:
+    bot = commands.Bot(command_prefix='@')
 bot.remove_command("help")
 bot.add_cog(Music(bot))
 
+# Replies from on_message go through a per-channel queue instead of blocking
+# the event loop, and bursts to one channel are merged into a single message.
+# The delay keeps the old pause before the tester replies.
+responder = ResponseScheduler(rate=int(os.getenv('REPLY_RATE', 5)), per=float(os.getenv('REPLY_PER', 5)))
+REPLY_DELAY = float(os.getenv('REPLY_DELAY', 0.8))
+
+loop_monitor = LoopMonitor(threshold=float(os.getenv('LOOP_STALL_THRESHOLD', 0.1)))
+bot.loop.call_soon(loop_monitor.start)
+
+
+ipc = None
+if os.getenv('IPC_PORT'):
+    ipc = IPCClient(CLUSTER_ID, os.getenv('IPC_SECRET', ''), port=int(os.getenv('IPC_PORT')))
+    bot.loop.create_task(ipc.run())
+
+    @ipc.handler('stats')
+    def cluster_stats(payload):
+        return local_stats()
+
+
+def local_stats():
+    music = bot.get_cog('Music')
+    states = music.voice_states if music else {}
+    return {
+        'shards': sorted(bot.shards) if isinstance(bot, commands.AutoShardedBot) else [0],
+        'guilds': len(bot.guilds),
+        'voice_states': len(states),
+        'connected': sum(1 for state in states.values() if state.voice),
+        'queued': sum(len(state.songs) for state in states.values()),
+        'latency': bot.latency,
+    }
+
+
+@bot.before_invoke
+async def label_command(ctx: commands.Context):
+    loop_monitor.label('@' + ctx.command.qualified_name)
+
+
+@bot.event
+async def on_connect():
+    # Also fires on every reconnect.
+    if 'connect' not in startup.phases:
+        startup.mark('connect')
+
 
 @bot.event
 async def on_ready():
     print('Logged in as: {0.user.name}'.format(bot))
+    if 'ready' in startup.phases:
+        return
 
-# WordSets and Images
-# url_swearwords = 'https://raw.githubusercontent.com/janray-pn/datasets/main/krulcifer-bot-datasets/swearwords.csv'
-# swearwords_data = pd.read_csv(url_swearwords)
-# swearwords_data.astype(str)
+    startup.mark('ready')
+    print('Started in {:.2f}s: {}'.format(startup.total, startup.report()))
+    if FAST_STARTUP:
+        bot.loop.create_task(start_deferred())
 
-# url_nicknames = 'https://raw.githubusercontent.com/janray-pn/datasets/main/krulcifer-bot-datasets/nicknames.csv'
-# nicknames_data = pd.read_csv(url_nicknames)
-# nicknames_data.astype(str)
 
-# restricted_words_list = []
-# restricted_words_list.append(swearwords_data['Swear_Word'].tolist())
-# restricted_words =[]
-# restricted_words = ','.join(str(i) for i in restricted_words_list)
-# print('swear', restricted_words)
+async def start_web_server():
+    # aiohttp.web is only imported here.
+    from keep_alive import keep_alive
 
-# restricted_names_list = []
-# restricted_names_list.append(nicknames_data['Nicknames'].tolist())
-# restricted_names = []
-# restricted_names = ','.join(str(j) for j in restricted_names_list)
-# print('names', restricted_names)
+    await keep_alive(bot, collect_metrics)
+
+
+async def start_deferred():
+    music = bot.get_cog('Music')
+    results = await asyncio.gather(
+        startup.track('web server', start_web_server()),
+        startup.track('extractor', YTDLSource.extractor.warm()),
+        startup.track('search index', music.seed_index()),
+        return_exceptions=True)
+    for error in results:
+        if isinstance(error, Exception):
+            print('Background startup step failed: {!r}'.format(error))
+    print('Background startup done: {}'.format(startup.report(background=True)))
+
+# WordSets and Images
+# Extra word lists are read from local copies of the krulcifer-bot-datasets CSVs
+# (https://github.com/janray-pn/datasets) and reloaded when the files change.
+SWEARWORDS_CSV = os.getenv('SWEARWORDS_CSV')
+NICKNAMES_CSV = os.getenv('NICKNAMES_CSV')
 
 
 restricted_words = [
@@ -531,6 +1740,23 @@ Krulcifer_angry = "https://cdn.discordapp.com/attachments/848340726499901472/848
 Krulcifer_profile = "https://cdn.discordapp.com/attachments/848340726499901472/848341528723062824/mainphoto.jpg"
 Krulcifer_janray = "https://cdn.discordapp.com/attachments/848340726499901472/848778029861699624/2538f38cccba720f7466143dbd6095cc.png"
 
+moderation = ModerationEngine(
+    user_roles={
+        'Tamago#3912': {'admin'},
+        'Tsukasa#9908': {'diagnostics', 'tester-exempt'},
+        'Tamagod#3912': {'tester-exempt'},
+        'Bronya#9911': {'tester-exempt'},
+        'Translator#2653': {'tester-exempt'},
+    },
+    channel_roles={
+        '💬-jp-chat': {'jp'},
+    })
+moderation.add_list('restricted_words', restricted_words, path=SWEARWORDS_CSV, column='Swear_Word')
+moderation.add_list('restricted_names', restricted_names, path=NICKNAMES_CSV, column='Nicknames')
+moderation.add_list('tester', tester)
+if SWEARWORDS_CSV or NICKNAMES_CSV:
+    bot.loop.create_task(moderation.watch())
+
 # Message Reader & help command
 
 
@@ -552,8 +1778,16 @@ async def help(ctx):
         name="@ping", value="Krulcifer will return its internet connection latency", inline=False)
     embed.add_field(
         name="@play", value="<@play music-name>Krulcifer will play music", inline=False)
+    embed.add_field(
+        name="@playlist", value="<@playlist playlist-url>Krulcifer will queue a whole playlist", inline=False)
+    embed.add_field(
+        name="@search", value="<@search music-name>Lists known songs matching the name", inline=False)
+    embed.add_field(
+        name="@radio", value="<@radio station>Tunes in to a 24/7 station, @radio off to stop", inline=False)
     embed.add_field(
         name="@pause", value="Krulcifer will pause the music", inline=False)
+    embed.add_field(
+        name="@seek", value="<@seek 1:30>Jumps to a time in the current song", inline=False)
     embed.add_field(
         name="@stop", value="Krulcifer will stop the music", inline=False)
     embed.add_field(
@@ -566,6 +1800,10 @@ async def help(ctx):
         name="@queue", value="Display the list of music queued", inline=False)
     embed.add_field(
         name="@remove", value="Removes a song from the queue at a given index.", inline=False)
+    embed.add_field(
+        name="@move", value="<@move from to>Moves a song to another position in the queue", inline=False)
+    embed.add_field(
+        name="@dedupe", value="Removes duplicate songs from the queue", inline=False)
     embed.add_field(
         name="@resume", value="Resume the paused music", inline=False)
     embed.add_field(name="@shuffle",
@@ -574,6 +1812,8 @@ async def help(ctx):
         name="@skip", value="Vote to skip the song. The Requester can automatically skip", inline=False)
     embed.add_field(
         name="@volume", value="Sets the volume of a player 0-100", inline=False)
+    embed.add_field(
+        name="@bitrate", value="<@bitrate kbps|auto>Sets the stream quality, auto follows the voice channel", inline=False)
     embed.set_footer(text="Learn more by typing .help")
     await ctx.send(embed=embed)
 
@@ -581,8 +1821,104 @@ async def help(ctx):
 @bot.command()
 async def ping(ctx, index=5):
     for i in range(index):
-        await ctx.send(f'`Krulcifer Latency: {round(bot.latency * 1000)}ms`')
-    await ctx.send('`Krulcifer is nominal`')
+        responder.send(ctx.channel, f'`Krulcifer Latency: {round(bot.latency * 1000)}ms`')
+    responder.send(ctx.channel, '`Krulcifer is nominal`')
+
+
+@bot.command()
+@commands.is_owner()
+async def stalls(ctx, count: int = 5):
+    lag = loop_monitor.stats()
+    embed = discord.Embed(
+        title='Event loop stalls',
+        description='lag p50 `{:.1f}ms` p99 `{:.1f}ms` max `{:.1f}ms`'.format(
+            lag['p50'] * 1000, lag['p99'] * 1000, lag['max'] * 1000),
+        color=discord.Color.purple())
+
+    for stall in list(loop_monitor.stalls)[-count:][::-1]:
+        stack = ''.join(stall.stack[-3:])[-900:]
+        embed.add_field(
+            name='{:.0f}ms in {} ({})'.format(stall.duration * 1000, stall.label or stall.task or 'callback',
+                                               time.strftime('%H:%M:%S', time.gmtime(stall.started))),
+            value='```py\n{}```'.format(stack or 'no stack sample'), inline=False)
+
+    await ctx.send(embed=embed)
+
+
+@bot.command()
+@commands.is_owner()
+async def traces(ctx):
+    tracer = Music.tracer
+    lines = ['`{:<12} {:>6} {:>8} {:>8} {:>8}`'.format('stage', 'n', 'p50', 'p90', 'p99')]
+    # In pipeline order; spans nest, so the stages don't add up to the total.
+    order = ('join', 'resolve', 'search', 'extract', 'queued', 'stream', 'ffmpeg', 'first audio', 'total')
+    percentiles = tracer.percentiles()
+    for stage in sorted(percentiles, key=lambda stage: order.index(stage) if stage in order else len(order)):
+        samples, values = percentiles[stage]
+        lines.append('`{:<12} {:>6} {:>6.0f}ms {:>6.0f}ms {:>6.0f}ms`'.format(
+            stage, samples, *(value * 1000 for value in values)))
+
+    embed = discord.Embed(title='@play stages', description='\n'.join(lines), color=discord.Color.purple())
+    embed.set_footer(text='{:.0%} of requests sampled, {} traced, {} failed{}'.format(
+        tracer.sample_rate, tracer.finished, tracer.failed,
+        ', written to {}'.format(tracer.path) if tracer.path else ''))
+    await ctx.send(embed=embed)
+
+
+@bot.command()
+@commands.is_owner()
+async def clusters(ctx):
+    hub_down = ipc is not None and not ipc.connected
+    if ipc is not None and not hub_down:
+        try:
+            results = await ipc.broadcast('stats')
+        except IPCError as e:
+            return await ctx.send('`{}`'.format(e))
+    else:
+        # Without the launcher's hub this cluster can still speak for itself.
+        results = {str(CLUSTER_ID): local_stats()}
+
+    embed = discord.Embed(title='Krulcifer clusters', color=discord.Color.purple())
+    for cluster, stats in sorted(results.items(), key=lambda item: int(item[0])):
+        if stats is None:
+            embed.add_field(name='Cluster {}'.format(cluster), value='`no answer`', inline=False)
+            continue
+
+        embed.add_field(
+            name='Cluster {} (shards {})'.format(cluster, ', '.join(map(str, stats['shards']))),
+            value='{guilds} guilds, {connected}/{voice_states} voice states connected, {queued} tracks queued, '
+                  'latency {latency_ms:.0f}ms'.format(latency_ms=stats['latency'] * 1000, **stats),
+            inline=False)
+
+    answered = [stats for stats in results.values() if stats is not None]
+    footer = '{} guilds, {} voice connections in total'.format(
+        sum(stats['guilds'] for stats in answered), sum(stats['connected'] for stats in answered))
+    if hub_down:
+        footer += ' (launcher unreachable, only this cluster is shown)'
+    embed.set_footer(text=footer)
+    await ctx.send(embed=embed)
+
+
+@bot.command()
+@commands.is_owner()
+async def states(ctx, count: int = 10):
+    music = bot.get_cog('Music')
+    sizes = sorted(((state.memory(), guild_id, state) for guild_id, state in music.voice_states.items()),
+                   key=lambda item: item[0], reverse=True)
+    now = time.monotonic()
+
+    lines = []
+    for size, guild_id, state in sizes[:count]:
+        lines.append('`{}` {:.1f} KiB, {} tracks, {} tasks, idle {:.0f}s{}'.format(
+            guild_id, size / 1024, len(state.songs), state.live_tasks(), now - state.last_active,
+            ', connected' if state.voice else ''))
+
+    embed = discord.Embed(title='Voice states', description='\n'.join(lines) or 'None',
+                          color=discord.Color.purple())
+    embed.set_footer(text='{} states, {:.1f} KiB, {} live tasks, {} evicted'.format(
+        len(sizes), sum(size for size, _, _ in sizes) / 1024,
+        sum(state.live_tasks() for _, _, state in sizes), music.evictions))
+    await ctx.send(embed=embed)
 
 
 @bot.command()
@@ -604,32 +1940,30 @@ async def on_message(message):
     if message.author == bot.user:
         return
 
-    if str(message.author) == "Tamago#3912":
-        if any(word in sentence for word in restricted_words):
-            await message.channel.send('Ara ara.. `Janray` 何をしたんだ？ ')
-            await message.channel.send(Krulcifer_angry)
+    roles = moderation.user_roles(message.author)
+
+    if 'admin' in roles:
+        if moderation.search('restricted_words', sentence):
+            responder.send(message.channel, 'Ara ara.. `Janray` 何をしたんだ？ ')
+            responder.send(message.channel, Krulcifer_angry)
 
-    if str(message.author) == "Tsukasa#9908":
+    if 'diagnostics' in roles:
         if message.content.startswith("Krulcifer: command ping"):
-            await message.channel.send("```yaml\nMusic-Cogs:(Working) Passed```")
-            await message.channel.send("```yaml\nObserver-Cogs:(Working) Passed```")
-            await message.channel.send("```yaml\nFlask-Cogs:(Working) Passed```")
-            await message.channel.send("```yaml\nUptimeRobot-Cogs:(Working) Passed```")
-            await message.channel.send(f'```yaml\nKrulcifer Latency: {round(bot.latency * 1000)}ms```')
-
-    time.sleep(0.8)
-    if str(message.author) != "Tamagod#3912":
-        if str(message.author) != "Bronya#9911":
-            if str(message.author) != "Translator#2653":
-                if str(message.author) != "Tsukasa#9908":
-                    if any(word in sentence for word in tester):
-
-                        if message.channel.name == '💬-jp-chat':
-                            await message.channel.send(str(message.author.nick) + '-san.. それは何ですか、あなたは私の夫が必要ですか')
-                            await message.channel.send(Krulcifer_janray)
-                        else:
-                            await message.channel.send(str(message.author.nick) + ' Hmm？ Do you need my darling?')
-                            await message.channel.send(Krulcifer_janray)
+            responder.send(message.channel, "```yaml\nMusic-Cogs:(Working) Passed```")
+            responder.send(message.channel, "```yaml\nObserver-Cogs:(Working) Passed```")
+            responder.send(message.channel, "```yaml\nFlask-Cogs:(Working) Passed```")
+            responder.send(message.channel, "```yaml\nUptimeRobot-Cogs:(Working) Passed```")
+            responder.send(message.channel, f'```yaml\nKrulcifer Latency: {round(bot.latency * 1000)}ms```')
+
+    if 'tester-exempt' not in roles:
+        if moderation.search('tester', sentence):
+
+            if 'jp' in moderation.channel_roles(message.channel):
+                responder.send(message.channel, str(message.author.nick) + '-san.. それは何ですか、あなたは私の夫が必要ですか', delay=REPLY_DELAY)
+                responder.send(message.channel, Krulcifer_janray, delay=REPLY_DELAY)
+            else:
+                responder.send(message.channel, str(message.author.nick) + ' Hmm？ Do you need my darling?', delay=REPLY_DELAY)
+                responder.send(message.channel, Krulcifer_janray, delay=REPLY_DELAY)
 
     if "@chat" in message.content:
         await message.delete()
@@ -637,5 +1971,99 @@ async def on_message(message):
     await bot.process_commands(message)
 
 
-keep_alive()
-bot.run(os.getenv("TOKEN"))
+def collect_metrics():
+    music = bot.get_cog('Music')
+    states = music.voice_states if music else {}
+
+    yield from metrics.gauge('krulcifer_startup_phase_seconds', 'Time spent in each startup phase.',
+                             [({'phase': name, 'background': 'false'}, seconds)
+                              for name, seconds in startup.phases.items()] +
+                             [({'phase': name, 'background': 'true'}, seconds)
+                              for name, seconds in startup.background.items()])
+    yield from metrics.gauge('krulcifer_gateway_latency_seconds', 'Gateway heartbeat latency.', bot.latency)
+    yield from metrics.gauge('krulcifer_guilds', 'Guilds the bot is in.', len(bot.guilds))
+    yield from metrics.gauge('krulcifer_voice_states', 'Guilds with a VoiceState.', len(states))
+    yield from metrics.gauge('krulcifer_voice_states_connected', 'Guilds with a VoiceState connected to voice.',
+                             sum(1 for state in states.values() if state.voice))
+    yield from metrics.gauge('krulcifer_voice_state_tasks', 'Live tasks owned by VoiceStates.',
+                             sum(state.live_tasks() for state in states.values()))
+    yield from metrics.counter('krulcifer_voice_state_evictions_total', 'VoiceStates evicted.',
+                               music.evictions if music else 0)
+    yield from metrics.counter('krulcifer_stream_resumes_total', 'Tracks resumed after their stream broke off.',
+                               VoiceState.resumes)
+    yield from metrics.counter('krulcifer_voice_state_restores_total', 'VoiceStates restored from a snapshot.',
+                               music.restores if music else 0)
+    yield from RESTORE_SECONDS.render()
+    yield from metrics.gauge('krulcifer_queue_length', 'Tracks queued per guild.',
+                             [({'guild': guild_id}, len(state.songs)) for guild_id, state in states.items()])
+    yield from metrics.counter('krulcifer_stream_kbps_total',
+                               'Audio kbps summed over started streams, as picked for the channel and at best quality.',
+                               [({'format': 'selected'}, YTDLSource.selected_kbps),
+                                ({'format': 'best'}, YTDLSource.best_kbps)])
+    yield from metrics.counter('krulcifer_stream_formats_total', 'Streams started per selected audio codec.',
+                               [({'codec': codec}, count) for codec, count in YTDLSource.selected_codecs.items()])
+    yield from metrics.gauge('krulcifer_ffmpeg_processes', 'Running FFmpeg playback processes.',
+                             sum(1 for state in states.values()
+                                 if state.current and state.current.source and state.current.source.ffmpeg_running))
+
+    yield from EXTRACTION_SECONDS.render()
+    yield from metrics.gauge('krulcifer_extraction_delay_seconds', 'Wait of the oldest queued extract_info call.',
+                             YTDLSource.extractor.delay())
+    admission = Music.admission.stats()
+    yield from metrics.counter('krulcifer_admissions_total', '@play and @playlist requests admitted or refused.',
+                               [({'result': result}, admission.get(result, 0))
+                                for result in ('admitted', 'user', 'guild', 'queue', 'overload')])
+    yield from tracing.STAGE_SECONDS.render()
+    extractor = YTDLSource.extractor.stats()
+    yield from metrics.gauge('krulcifer_extraction_active', 'extract_info calls running.', extractor['active'])
+    yield from metrics.gauge('krulcifer_extraction_queued', 'extract_info calls waiting.', extractor['queued'])
+    yield from metrics.counter('krulcifer_extraction_total', 'Finished or rejected extract_info calls.',
+                               [({'result': result}, extractor[result]) for result in ('completed', 'failed', 'rejected')])
+
+    radio = music.radio.stats() if music and music.radio else {}
+    yield from metrics.gauge('krulcifer_radio_listeners', 'Guilds tuned in per running radio station.',
+                             [({'station': name}, stats['listeners']) for name, stats in radio.items()])
+
+    index = YTDLSource.search_index.stats()
+    yield from metrics.gauge('krulcifer_search_index_tracks', 'Tracks in the local search index.', index['size'])
+    yield from metrics.counter('krulcifer_search_index_lookups_total', 'Free-text queries checked against the index.',
+                               [({'result': result}, index[result]) for result in ('matches', 'misses')])
+
+    flights = YTDLSource.flights.stats()
+    yield from metrics.counter('krulcifer_resolutions_total', 'Resolutions started or joined while in flight.',
+                               [({'result': 'started'}, flights['calls'] - flights['shared']),
+                                ({'result': 'shared'}, flights['shared'])])
+    yield from metrics.gauge('krulcifer_resolutions_in_flight', 'Distinct resolutions running.', flights['in_flight'])
+
+    cache = YTDLSource.cache.stats()
+    yield from metrics.gauge('krulcifer_metadata_cache_size', 'Entries in the metadata cache.', cache['size'])
+    yield from metrics.counter('krulcifer_metadata_cache_lookups_total', 'Metadata cache lookups.',
+                               [({'result': result}, cache[result]) for result in ('hits', 'stale', 'misses')])
+    yield from metrics.counter('krulcifer_metadata_cache_evictions_total', 'Metadata cache evictions.',
+                               cache['evictions'])
+
+    if YTDLSource.audio_cache is not None:
+        audio = YTDLSource.audio_cache.stats()
+        yield from metrics.gauge('krulcifer_audio_cache_bytes', 'Size of the audio cache.', audio['bytes'])
+        yield from metrics.counter('krulcifer_audio_cache_lookups_total', 'Audio cache lookups.',
+                                   [({'result': result}, audio[result]) for result in ('hits', 'misses')])
+
+    lag = loop_monitor.stats()
+    yield from metrics.gauge('krulcifer_loop_lag_seconds', 'Event loop lag over the last minute.',
+                             [({'quantile': quantile}, lag[key]) for quantile, key in (('0.5', 'p50'), ('0.99', 'p99'))])
+    yield from metrics.gauge('krulcifer_loop_lag_max_seconds', 'Largest event loop lag seen.', lag['max'])
+    yield from metrics.gauge('krulcifer_loop_stalls', 'Stalls held in the ring buffer.', lag['stalls'])
+
+    replies = responder.stats()
+    yield from metrics.gauge('krulcifer_reply_queue_depth', 'Replies waiting to be sent.', replies['depth'])
+    yield from metrics.counter('krulcifer_replies_total', 'Replies handled by the response scheduler.',
+                               [({'result': result}, replies[result])
+                                for result in ('sent', 'coalesced', 'dropped', 'failed')])
+
+
+if __name__ == '__main__':
+    startup.mark('setup')
+    if not FAST_STARTUP:
+        bot.loop.run_until_complete(start_web_server())
+        startup.mark('web server')
+    bot.run(os.getenv("TOKEN"))
@@ -0,0 +1,80 @@
+import bisect
+import math
+
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def _labels(labels: dict):
+    if not labels:
+        return ''
+
+    return '{' + ','.join('{}="{}"'.format(key, _escape(value)) for key, value in labels.items()) + '}'
+
+
+def _value(value):
+    value = float(value)
+    if math.isnan(value):
+        return 'NaN'
+    if math.isinf(value):
+        return '+Inf' if value > 0 else '-Inf'
+
+    return repr(value)
+
+
+def render(name: str, kind: str, help: str, samples):
+    """Renders one metric family in the Prometheus text format.
+
+    `samples` is either a single number or an iterable of `(labels, value)`.
+    """
+    lines = ['# HELP {} {}'.format(name, help), '# TYPE {} {}'.format(name, kind)]
+    if isinstance(samples, (int, float)):
+        samples = [({}, samples)]
+
+    for labels, value in samples:
+        lines.append('{}{} {}'.format(name, _labels(labels), _value(value)))
+
+    return lines
+
+
+def gauge(name: str, help: str, samples):
+    return render(name, 'gauge', help, samples)
+
+
+def counter(name: str, help: str, samples):
+    return render(name, 'counter', help, samples)
+
+
+class Histogram:
+    DEFAULT_BUCKETS = (0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+    def __init__(self, name: str, help: str, *, buckets=DEFAULT_BUCKETS, labels=()):
+        self.name = name
+        self.help = help
+        self.buckets = tuple(sorted(buckets))
+        self.labels = tuple(labels)
+        self._series = {}
+
+    def observe(self, value: float, **labels):
+        key = tuple(labels.get(label, '') for label in self.labels)
+        series = self._series.get(key)
+        if series is None:
+            series = self._series[key] = [[0] * (len(self.buckets) + 1), 0.0]
+
+        series[0][bisect.bisect_left(self.buckets, value)] += 1
+        series[1] += value
+
+    def render(self):
+        lines = ['# HELP {} {}'.format(self.name, self.help), '# TYPE {} histogram'.format(self.name)]
+        for key, (counts, total) in self._series.items():
+            labels = dict(zip(self.labels, key))
+            cumulative = 0
+            for bound, count in zip(self.buckets + (math.inf,), counts):
+                cumulative += count
+                lines.append('{}_bucket{} {}'.format(
+                    self.name, _labels(dict(labels, le=_value(bound))), cumulative))
+            lines.append('{}_sum{} {}'.format(self.name, _labels(labels), _value(total)))
+            lines.append('{}_count{} {}'.format(self.name, _labels(labels), cumulative))
+
+        return lines
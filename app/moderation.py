@@ -0,0 +1,166 @@
+import asyncio
+import collections
+import csv
+import os
+
+
+def _is_word_char(char: str):
+    # Only ASCII: Japanese text has no spaces between words.
+    return char.isascii() and (char.isalnum() or char == '_')
+
+
+class WordMatcher:
+    """Aho-Corasick automaton over a word list.
+
+    Matching costs one pass over the text whatever the number of words. A
+    match has to start a word, so `ass` matches "you ass!" but not "class",
+    while inflections and suffixes still count: `fuck` matches "fuckin" and
+    `janray` matches "janrayさん".
+    """
+
+    def __init__(self, words):
+        self._goto = [{}]
+        self._fail = [0]
+        self._out = [()]
+        self.size = 0
+
+        for word in words:
+            word = word.strip().casefold()
+            if word:
+                self._add(word)
+        self._build()
+
+    def __len__(self):
+        return self.size
+
+    def _add(self, word: str):
+        node = 0
+        for char in word:
+            child = self._goto[node].get(char)
+            if child is None:
+                child = len(self._goto)
+                self._goto[node][char] = child
+                self._goto.append({})
+                self._fail.append(0)
+                self._out.append(())
+            node = child
+
+        if len(word) not in self._out[node]:
+            self._out[node] += (len(word),)
+            self.size += 1
+
+    def _build(self):
+        queue = collections.deque(self._goto[0].values())
+        while queue:
+            node = queue.popleft()
+            for char, child in self._goto[node].items():
+                queue.append(child)
+
+                fail = self._fail[node]
+                while fail and char not in self._goto[fail]:
+                    fail = self._fail[fail]
+                self._fail[child] = self._goto[fail].get(char, 0)
+                self._out[child] += self._out[self._fail[child]]
+
+    def search(self, text: str):
+        """Returns the first word of the list found at the start of a word in
+        `text`, or None."""
+        text = text.casefold()
+        goto, fail, out = self._goto, self._fail, self._out
+        node = 0
+        for end, char in enumerate(text):
+            while node and char not in goto[node]:
+                node = fail[node]
+            node = goto[node].get(char, 0)
+
+            for length in out[node]:
+                start = end - length + 1
+                if start == 0 or not _is_word_char(text[start - 1]):
+                    return text[start:end + 1]
+
+        return None
+
+
+def load_words(path: str, column: str = None):
+    """Reads a word list from a local CSV file, one word per row, taking
+    `column` when the file has a header."""
+    with open(path, newline='', encoding='utf-8') as f:
+        if column is None:
+            return [row[0] for row in csv.reader(f) if row]
+
+        return [row[column] for row in csv.DictReader(f) if row.get(column)]
+
+
+class ModerationEngine:
+    """Word lists and user/channel rules for on_message.
+
+    Users and channels are looked up by id. Rules can still be written with
+    the old `Name#1234` tags and channel names; the id is learned the first
+    time one of them is seen, so later lookups for them are a single dict hit.
+    """
+
+    def __init__(self, *, user_roles: dict = None, channel_roles: dict = None):
+        self._user_roles = {}
+        self._tag_roles = {}
+        self._channel_roles = {}
+        self._channel_name_roles = {}
+
+        for user, roles in (user_roles or {}).items():
+            table = self._user_roles if isinstance(user, int) else self._tag_roles
+            table[user] = frozenset(roles)
+        for channel, roles in (channel_roles or {}).items():
+            table = self._channel_roles if isinstance(channel, int) else self._channel_name_roles
+            table[channel] = frozenset(roles)
+
+        self._lists = {}
+        self._matchers = {}
+
+    def user_roles(self, user):
+        roles = self._user_roles.get(user.id)
+        if roles is None:
+            roles = self._tag_roles.get(str(user), frozenset())
+            if roles:
+                self._user_roles[user.id] = roles
+
+        return roles
+
+    def channel_roles(self, channel):
+        roles = self._channel_roles.get(channel.id)
+        if roles is None:
+            name = getattr(channel, 'name', None)
+            roles = self._channel_roles[channel.id] = self._channel_name_roles.get(name, frozenset())
+
+        return roles
+
+    def add_list(self, name: str, words, *, path: str = None, column: str = None):
+        """Registers a word list built from `words` plus, optionally, a local
+        CSV file that is reloaded whenever it changes."""
+        self._lists[name] = (list(words), path, column, None)
+        self._compile(name)
+
+    def _compile(self, name: str):
+        words, path, column, _ = self._lists[name]
+        mtime = None
+        if path is not None and os.path.exists(path):
+            mtime = os.stat(path).st_mtime
+            words = words + load_words(path, column)
+
+        self._lists[name] = (self._lists[name][0], path, column, mtime)
+        self._matchers[name] = WordMatcher(words)
+
+    def search(self, name: str, text: str):
+        return self._matchers[name].search(text)
+
+    async def watch(self, interval: float = 10.0):
+        """Recompiles any list whose CSV file changed, off the event loop."""
+        loop = asyncio.get_event_loop()
+        while True:
+            await asyncio.sleep(interval)
+            for name, (_, path, _, mtime) in list(self._lists.items()):
+                if path is None or not os.path.exists(path) or os.stat(path).st_mtime == mtime:
+                    continue
+
+                try:
+                    await loop.run_in_executor(None, self._compile, name)
+                except (OSError, csv.Error, KeyError) as e:
+                    print('Failed to reload word list {}: {}'.format(name, e))
@@ -0,0 +1,235 @@
+import asyncio
+import collections
+import functools
+import itertools
+import threading
+import time
+
+import discord
+
+
+OPUS_SILENCE = b'\xf8\xff\xfe'
+FRAME_SECONDS = discord.opus.Encoder.FRAME_LENGTH / 1000
+
+
+def parse_stations(value: str):
+    """Parses `name=url,url;name=url` into `{name: [url, ...]}`."""
+    stations = {}
+    for station in filter(None, (part.strip() for part in value.split(';'))):
+        name, _, urls = station.partition('=')
+        stations[name.strip().casefold()] = [url.strip() for url in urls.split(',') if url.strip()]
+
+    return stations
+
+
+class Broadcast:
+    """One FFmpeg pipeline for a station, shared by every guild tuned in.
+
+    A producer thread plays the station's tracks in a loop and appends the
+    encoded Opus frames to a ring buffer at real-time pace. Listeners keep
+    their own position in it, so FFmpeg processes and upstream bandwidth
+    scale with the number of stations rather than the number of guilds.
+    Frames are encoded once, so the per-guild volume doesn't apply.
+    """
+
+    def __init__(self, name: str, urls: list, *, resolve, loop: asyncio.AbstractEventLoop,
+                 ffmpeg_options: dict, bitrate: int = 128, buffer: float = 10.0):
+        self.name = name
+        self.urls = urls
+        self.bitrate = bitrate
+        self.ffmpeg_options = ffmpeg_options
+        self.title = None
+        self.listeners = 0
+        self.frames = 0
+        # Called from whichever thread drops the last listener.
+        self.on_idle = None
+
+        self._resolve = resolve
+        self._loop = loop
+        self._ring = collections.deque(maxlen=int(buffer / FRAME_SECONDS))
+        self._first = 0
+        self._finished = False
+        self._ready = threading.Condition()
+        self._stopped = threading.Event()
+        self._thread = threading.Thread(target=self._run, name='radio-{}'.format(name), daemon=True)
+
+    def start(self):
+        self._thread.start()
+
+    def stop(self):
+        self._stopped.set()
+
+    @property
+    def running(self):
+        return self._thread.is_alive()
+
+    def _run(self):
+        try:
+            for url in itertools.cycle(self.urls):
+                if self._stopped.is_set():
+                    break
+                self._play(url)
+        finally:
+            with self._ready:
+                self._finished = True
+                self._ready.notify_all()
+
+    def _play(self, url: str):
+        try:
+            info = asyncio.run_coroutine_threadsafe(self._resolve(url), self._loop).result()
+        except Exception as e:
+            print('Radio {} skipped {}: {}'.format(self.name, url, e))
+            self._stopped.wait(5)
+            return
+
+        self.title = info.get('title')
+        options = self.ffmpeg_options
+        if info.get('acodec') == 'opus':
+            # Only 'opus' makes discord.py pass the stream through; 'copy' re-encodes.
+            source = discord.FFmpegOpusAudio(info['url'], codec='opus', **options)
+        else:
+            source = discord.FFmpegOpusAudio(info['url'], bitrate=self.bitrate, **options)
+
+        due = time.perf_counter()
+        try:
+            while not self._stopped.is_set():
+                frame = source.read()
+                if not frame:
+                    break
+
+                with self._ready:
+                    if len(self._ring) == self._ring.maxlen:
+                        self._first += 1
+                    self._ring.append(frame)
+                    self.frames += 1
+                    self._ready.notify_all()
+
+                due += FRAME_SECONDS
+                delay = due - time.perf_counter()
+                if delay > 0:
+                    time.sleep(delay)
+        finally:
+            source.cleanup()
+
+    def listen(self, lag: float = 1.0):
+        """Returns a new listener starting `lag` seconds behind the live edge."""
+        with self._ready:
+            position = max(self._first + len(self._ring) - int(lag / FRAME_SECONDS), self._first)
+            self.listeners += 1
+
+        return BroadcastListener(self, position)
+
+    def leave(self):
+        with self._ready:
+            self.listeners -= 1
+            idle = self.listeners <= 0
+
+        if idle and self.on_idle is not None:
+            self.on_idle()
+
+    def read(self, position: int):
+        """Returns `(frame, next_position)`; silence if the producer is
+        behind, b'' once the broadcast has ended."""
+        with self._ready:
+            # A listener that fell out of the ring skips ahead.
+            position = max(position, self._first)
+            if position >= self._first + len(self._ring) and not self._finished:
+                self._ready.wait(FRAME_SECONDS * 5)
+
+            if position < self._first + len(self._ring):
+                return self._ring[position - self._first], position + 1
+            if self._finished:
+                return b'', position
+
+        return OPUS_SILENCE, position
+
+
+class BroadcastListener(discord.AudioSource):
+    def __init__(self, broadcast: Broadcast, position: int):
+        self.broadcast = broadcast
+        self.position = position
+        self.closed = False
+
+    def read(self):
+        frame, self.position = self.broadcast.read(self.position)
+        return frame
+
+    def is_opus(self):
+        return True
+
+    def cleanup(self):
+        # discord.py calls this on the player thread when playback stops.
+        if not self.closed:
+            self.closed = True
+            self.broadcast.leave()
+
+
+class RadioHub:
+    """Starts a station's Broadcast on its first listener and stops it
+    `grace` seconds after its last one left."""
+
+    def __init__(self, stations: dict, *, resolve, expand, ffmpeg_options: dict, bitrate: int = 128,
+                 grace: float = 30.0, loop: asyncio.AbstractEventLoop = None):
+        self.stations = stations
+        self.bitrate = bitrate
+        self.grace = grace
+        self.ffmpeg_options = ffmpeg_options
+
+        self._resolve = resolve
+        self._expand = expand
+        self._loop = loop or asyncio.get_event_loop()
+        self._broadcasts = {}
+        self._starting = {}
+
+    async def tune(self, name: str):
+        """Returns a listener for station `name`, starting it if needed."""
+        if name not in self.stations:
+            raise KeyError(name)
+
+        broadcast = self._broadcasts.get(name)
+        if broadcast is None or not broadcast.running:
+            # Concurrent first listeners share one start-up.
+            starting = self._starting.get(name)
+            if starting is None:
+                starting = self._starting[name] = self._loop.create_task(self._start(name))
+                starting.add_done_callback(lambda task: self._starting.pop(name, None))
+            broadcast = await asyncio.shield(starting)
+
+        listener = broadcast.listen()
+        self._loop.call_later(self.grace, self._reap, name)
+
+        return listener
+
+    async def _start(self, name: str):
+        urls = []
+        for url in self.stations[name]:
+            urls.extend(await self._expand(url))
+        if not urls:
+            raise ValueError('Station {} has no playable tracks'.format(name))
+
+        broadcast = Broadcast(name, urls, resolve=self._resolve, loop=self._loop,
+                              ffmpeg_options=self.ffmpeg_options, bitrate=self.bitrate)
+        broadcast.on_idle = functools.partial(self._schedule_reap, name)
+        broadcast.start()
+        self._broadcasts[name] = broadcast
+
+        return broadcast
+
+    def _schedule_reap(self, name: str):
+        # Runs on the player thread that dropped the last listener.
+        self._loop.call_soon_threadsafe(self._loop.call_later, self.grace, self._reap, name)
+
+    def _reap(self, name: str):
+        broadcast = self._broadcasts.get(name)
+        if broadcast is not None and broadcast.listeners <= 0:
+            broadcast.stop()
+            del self._broadcasts[name]
+
+    def stats(self):
+        return {name: {'listeners': broadcast.listeners, 'title': broadcast.title, 'frames': broadcast.frames}
+                for name, broadcast in self._broadcasts.items()}
+
+    def close(self):
+        for broadcast in self._broadcasts.values():
+            broadcast.stop()
+        self._broadcasts.clear()
@@ -0,0 +1,174 @@
+import asyncio
+import collections
+import sys
+
+
+class _Channel:
+    __slots__ = ('pending', 'tokens', 'updated', 'task')
+
+    def __init__(self, tokens: float, now: float):
+        self.pending = collections.deque()
+        self.tokens = tokens
+        self.updated = now
+        self.task = None
+
+
+def _retrieve(future: asyncio.Future):
+    # Most callers never await their future; a failed send is logged once in
+    # _drain instead of as "Future exception was never retrieved".
+    if not future.cancelled():
+        future.exception()
+
+
+class ResponseScheduler:
+    """Sends the bot's own replies from a per-channel queue.
+
+    Message creation is rate limited by Discord per channel, so every channel
+    gets its own FIFO and token bucket (`rate` sends per `per` seconds) and
+    one drain task. Callers never block on it: `send` returns a future that
+    resolves to the sent message.
+
+    The bucket defaults to Discord's message create limit of 5 per 5 seconds
+    per channel. discord.py 1.x keeps the X-RateLimit-* headers inside its
+    HTTP client, which waits on them itself, so the bucket only has to keep
+    replies from queueing up there.
+
+    Consecutive plain sends to a channel that are ready within `window`
+    seconds of each other go out as one message, as long as the result fits
+    Discord's limits (2000 characters, one embed in this API version).
+    """
+
+    MAX_CONTENT = 2000
+
+    def __init__(self, *, rate: int = 5, per: float = 5.0, max_depth: int = 50, window: float = 0.05):
+        self.rate = rate
+        self.per = per
+        self.max_depth = max_depth
+        self.window = window
+
+        self._channels = {}
+
+        self.sent = 0
+        self.coalesced = 0
+        self.dropped = 0
+        self.failed = 0
+
+    def send(self, channel, content: str = None, *, delay: float = 0.0, **kwargs):
+        loop = asyncio.get_event_loop()
+        future = loop.create_future()
+        future.add_done_callback(_retrieve)
+
+        now = loop.time()
+        state = self._channels.get(channel.id)
+        if state is None:
+            if len(self._channels) >= 1024:
+                self._prune(now)
+            state = self._channels[channel.id] = _Channel(self.rate, now)
+
+        if len(state.pending) >= self.max_depth:
+            self.dropped += 1
+            future.cancel()
+            return future
+
+        state.pending.append((now + delay, channel, content, kwargs, future))
+        if state.task is None:
+            state.task = loop.create_task(self._drain(state))
+
+        return future
+
+    def _refill(self, state: _Channel, now: float):
+        state.tokens = min(self.rate, state.tokens + (now - state.updated) * self.rate / self.per)
+        state.updated = now
+
+    async def _drain(self, state: _Channel):
+        loop = asyncio.get_event_loop()
+        try:
+            while state.pending:
+                ready_at, channel, content, kwargs, future = state.pending[0]
+                now = loop.time()
+                self._refill(state, now)
+
+                wait = max(ready_at - now, (1 - state.tokens) * self.per / self.rate)
+                if wait <= 0 and len(state.pending) == 1 and self._mergeable(kwargs) and now - ready_at < self.window:
+                    # Give the rest of a burst a moment to arrive.
+                    wait = self.window
+                if wait > 0:
+                    await asyncio.sleep(wait)
+                    continue
+
+                state.pending.popleft()
+                state.tokens -= 1
+                futures = [future]
+                if self._mergeable(kwargs):
+                    content, kwargs = self._merge(state, content, kwargs, futures, now)
+                if all(future.cancelled() for future in futures):
+                    continue
+
+                try:
+                    message = await channel.send(content, **kwargs)
+                except Exception as e:
+                    self.failed += 1
+                    print('Reply to channel {} failed: {!r}'.format(channel.id, e), file=sys.stderr)
+                    for future in futures:
+                        if not future.done():
+                            future.set_exception(e)
+                else:
+                    self.sent += 1
+                    for future in futures:
+                        if not future.done():
+                            future.set_result(message)
+        finally:
+            state.task = None
+
+    @staticmethod
+    def _mergeable(kwargs: dict):
+        return kwargs.keys() <= {'embed'}
+
+    def _merge(self, state: _Channel, content: str, kwargs: dict, futures: list, now: float):
+        kwargs = dict(kwargs)
+        while state.pending:
+            ready_at, _, next_content, next_kwargs, future = state.pending[0]
+            if ready_at > now + self.window or not self._mergeable(next_kwargs):
+                break
+            if 'embed' in kwargs and 'embed' in next_kwargs:
+                break
+
+            if next_content is not None:
+                merged = next_content if content is None else '{}\n{}'.format(content, next_content)
+                if len(merged) > self.MAX_CONTENT:
+                    break
+            else:
+                merged = content
+
+            state.pending.popleft()
+            content = merged
+            kwargs.update(next_kwargs)
+            futures.append(future)
+            if not future.cancelled():
+                self.coalesced += 1
+
+        return content, kwargs
+
+    def _prune(self, now: float):
+        # A channel's bucket has to be kept until it has refilled, otherwise
+        # a new burst could start from a full bucket too early.
+        for key, state in list(self._channels.items()):
+            if state.task is None and now - state.updated >= self.per:
+                del self._channels[key]
+
+    def depth(self, channel_id: int = None):
+        if channel_id is None:
+            return sum(len(state.pending) for state in self._channels.values())
+
+        state = self._channels.get(channel_id)
+        return len(state.pending) if state is not None else 0
+
+    def stats(self):
+        return {
+            'channels': len(self._channels),
+            'depth': self.depth(),
+            'sent': self.sent,
+            'coalesced': self.coalesced,
+            'dropped': self.dropped,
+            'failed': self.failed,
+        }
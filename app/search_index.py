@@ -0,0 +1,160 @@
+import collections
+import math
+import re
+import threading
+
+
+_TOKEN_RE = re.compile(r'\w+')
+
+# Words that say nothing about which song was meant.
+NOISE = frozenset((
+    'a', 'an', 'and', 'audio', 'feat', 'ft', 'hd', 'hq', 'lyric', 'lyrics', 'music', 'mv', 'of', 'official',
+    'the', 'video', 'visualizer',
+))
+
+# Field weights for BM25F: a hit in the title counts most.
+WEIGHTS = (('title', 3.0), ('uploader', 1.5), ('tags', 1.0))
+
+
+def tokenize(text: str):
+    return _TOKEN_RE.findall(text.casefold())
+
+
+class IndexedTrack:
+    __slots__ = ('url', 'id', 'title', 'uploader', 'duration', 'terms', 'length', 'names')
+
+    def __init__(self, info: dict):
+        self.url = info['webpage_url']
+        self.id = info.get('id')
+        self.title = info.get('title') or ''
+        self.uploader = info.get('uploader') or ''
+        self.duration = int(info.get('duration') or 0)
+
+        fields = {
+            'title': tokenize(self.title),
+            'uploader': tokenize(self.uploader),
+            'tags': [token for tag in (info.get('tags') or ())[:20] for token in tokenize(tag)],
+        }
+        terms = collections.Counter()
+        for field, weight in WEIGHTS:
+            for token in fields[field]:
+                terms[token] += weight
+        self.terms = dict(terms)
+        self.length = sum(self.terms.values())
+        # What a query has to be made of to pick this track without a search.
+        self.names = frozenset(fields['title'] + fields['uploader']) - NOISE
+
+
+class TrackIndex:
+    """In-process BM25 index over the title, uploader and tags of resolved
+    tracks, updated as tracks are resolved.
+
+    `match()` only answers when a query clearly names one known track, so
+    free-text @play can skip the YouTube search extraction; `search()`
+    ranks everything for @search.
+    """
+
+    K1 = 1.2
+    B = 0.75
+
+    def __init__(self, maxsize: int = 50000, *, coverage: float = 0.5, margin: float = 1.5):
+        self.maxsize = maxsize
+        self.coverage = coverage
+        self.margin = margin
+
+        self._tracks = collections.OrderedDict()
+        self._postings = collections.defaultdict(dict)
+        self._total_length = 0.0
+        self._lock = threading.Lock()
+
+        self.matches = 0
+        self.misses = 0
+
+    def __len__(self):
+        return len(self._tracks)
+
+    def add(self, info: dict):
+        if not info.get('webpage_url'):
+            return
+
+        track = IndexedTrack(info)
+        with self._lock:
+            self._remove(track.url)
+            self._tracks[track.url] = track
+            for term, frequency in track.terms.items():
+                self._postings[term][track.url] = frequency
+            self._total_length += track.length
+
+            while len(self._tracks) > self.maxsize:
+                self._remove(next(iter(self._tracks)))
+
+    def extend(self, infos):
+        for info in infos:
+            self.add(info)
+
+    def _remove(self, url: str):
+        track = self._tracks.pop(url, None)
+        if track is None:
+            return
+
+        for term in track.terms:
+            postings = self._postings[term]
+            del postings[url]
+            if not postings:
+                del self._postings[term]
+        self._total_length -= track.length
+
+    def search(self, query: str, limit: int = 5):
+        """Returns up to `limit` `(score, IndexedTrack)` pairs, best first."""
+        terms = set(tokenize(query))
+        with self._lock:
+            if not self._tracks or not terms:
+                return []
+
+            count = len(self._tracks)
+            average = self._total_length / count
+            scores = collections.defaultdict(float)
+            for term in terms:
+                postings = self._postings.get(term)
+                if not postings:
+                    continue
+
+                idf = math.log(1 + (count - len(postings) + 0.5) / (len(postings) + 0.5))
+                for url, frequency in postings.items():
+                    length = self._tracks[url].length
+                    scores[url] += idf * frequency * (self.K1 + 1) / (
+                        frequency + self.K1 * (1 - self.B + self.B * length / average))
+
+            best = sorted(scores.items(), key=lambda item: item[1], reverse=True)[:limit]
+            return [(score, self._tracks[url]) for url, score in best]
+
+    def match(self, query: str):
+        """Returns the webpage URL of the one track `query` names, or None.
+
+        Every meaningful query word must appear in the track's title or
+        uploader, the query must cover at least `coverage` of them, and the
+        track must score `margin` times better than the runner-up.
+        """
+        words = set(tokenize(query)) - NOISE
+        if '://' in query or not words:
+            return None
+
+        results = self.search(query, limit=2)
+        if results:
+            score, track = results[0]
+            runner_up = results[1][0] if len(results) > 1 else 0.0
+            if (words <= track.names and len(words) >= self.coverage * len(track.names)
+                    and score >= self.margin * runner_up):
+                self.matches += 1
+                return track.url
+
+        self.misses += 1
+        return None
+
+    def stats(self):
+        return {
+            'size': len(self._tracks),
+            'terms': len(self._postings),
+            'matches': self.matches,
+            'misses': self.misses,
+        }
@@ -0,0 +1,136 @@
+import asyncio
+import concurrent.futures
+import json
+import os
+import sqlite3
+import time
+
+from metrics import Histogram
+
+
+RESTORE_SECONDS = Histogram(
+    'krulcifer_warm_restart_seconds', 'Time from process start until a restored guild plays again.',
+    buckets=(1, 2.5, 5, 10, 20, 30, 60, 120))
+
+
+class QueueSnapshots:
+    """Periodic, incremental snapshots of every guild's queue in sqlite.
+
+    Only compact track descriptors are stored. A guild is rewritten only
+    when its fingerprint changed since the last save, and only guilds this
+    process saved itself are ever deleted, so a file can be shared. The
+    launcher still gives each cluster its own to keep writers from contending.
+    """
+
+    def __init__(self, path: str):
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+
+        self._db = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self._db.execute('PRAGMA journal_mode=WAL')
+        self._db.execute('PRAGMA synchronous=NORMAL')
+        self._db.execute('CREATE TABLE IF NOT EXISTS guilds ('
+                         'guild_id INTEGER PRIMARY KEY, voice_channel_id INTEGER, text_channel_id INTEGER, '
+                         'volume REAL NOT NULL, loop INTEGER NOT NULL, current TEXT, position REAL NOT NULL, '
+                         'saved_at REAL NOT NULL)')
+        self._db.execute('CREATE TABLE IF NOT EXISTS tracks ('
+                         'guild_id INTEGER NOT NULL, seq INTEGER NOT NULL, track TEXT NOT NULL, '
+                         'PRIMARY KEY (guild_id, seq))')
+
+        # One writer thread keeps sqlite off the event loop and serialises writes.
+        self._executor = concurrent.futures.ThreadPoolExecutor(1, thread_name_prefix='snapshot')
+        self._fingerprints = {}
+        self._positions = {}
+
+        self.writes = 0
+
+    async def save(self, states):
+        """`states` yields `(guild_id, fingerprint, build, position)`.
+
+        `build()` returns the guild's snapshot and is only called when the
+        fingerprint changed; otherwise only a moved playback position is
+        written.
+        """
+        changed = []
+        moved = []
+        positions = {}
+        for guild_id, fingerprint, build, position in states:
+            positions[guild_id] = position
+            if self._fingerprints.get(guild_id) != fingerprint:
+                changed.append((guild_id, fingerprint, build()))
+            elif position != self._positions.get(guild_id):
+                moved.append((position, guild_id))
+
+        removed = [guild_id for guild_id in self._fingerprints if guild_id not in positions]
+        if not changed and not moved and not removed:
+            return
+
+        await asyncio.get_event_loop().run_in_executor(
+            self._executor, self._write, [(guild_id, data) for guild_id, _, data in changed], moved, removed)
+
+        # Only after the write, so a failed one is retried by the next save.
+        self._positions.update(positions)
+        for guild_id, fingerprint, _ in changed:
+            self._fingerprints[guild_id] = fingerprint
+        for guild_id in removed:
+            del self._fingerprints[guild_id]
+            self._positions.pop(guild_id, None)
+        self.writes += len(changed) + len(removed)
+
+    def _write(self, changed: list, moved: list, removed: list):
+        now = time.time()
+        self._db.execute('BEGIN')
+        try:
+            for guild_id, data in changed:
+                self._db.execute('INSERT OR REPLACE INTO guilds VALUES (?, ?, ?, ?, ?, ?, ?, ?)', (
+                    guild_id, data['voice_channel_id'], data['text_channel_id'], data['volume'], int(data['loop']),
+                    json.dumps(data['current']) if data['current'] else None, data['position'], now))
+                self._db.execute('DELETE FROM tracks WHERE guild_id = ?', (guild_id,))
+                self._db.executemany('INSERT INTO tracks VALUES (?, ?, ?)',
+                                     [(guild_id, seq, json.dumps(track)) for seq, track in enumerate(data['tracks'])])
+            self._db.executemany('UPDATE guilds SET position = ? WHERE guild_id = ?', moved)
+            for guild_id in removed:
+                self._db.execute('DELETE FROM guilds WHERE guild_id = ?', (guild_id,))
+                self._db.execute('DELETE FROM tracks WHERE guild_id = ?', (guild_id,))
+            self._db.execute('COMMIT')
+        except BaseException:
+            self._db.execute('ROLLBACK')
+            raise
+
+    async def load(self, guild_ids):
+        """Returns the stored snapshots for the given guilds."""
+        snapshots = await asyncio.get_event_loop().run_in_executor(self._executor, self._read, list(guild_ids))
+
+        # Claim them, so they are deleted if they don't get restored.
+        for snapshot in snapshots:
+            self._fingerprints.setdefault(snapshot['guild_id'], None)
+
+        return snapshots
+
+    def _read(self, guild_ids: list):
+        snapshots = []
+        for guild_id in guild_ids:
+            row = self._db.execute('SELECT voice_channel_id, text_channel_id, volume, loop, current, position '
+                                   'FROM guilds WHERE guild_id = ?', (guild_id,)).fetchone()
+            if row is None:
+                continue
+
+            tracks = [json.loads(track) for track, in self._db.execute(
+                'SELECT track FROM tracks WHERE guild_id = ? ORDER BY seq', (guild_id,))]
+            snapshots.append({
+                'guild_id': guild_id,
+                'voice_channel_id': row[0],
+                'text_channel_id': row[1],
+                'volume': row[2],
+                'loop': bool(row[3]),
+                'current': json.loads(row[4]) if row[4] else None,
+                'position': row[5],
+                'tracks': tracks,
+            })
+
+        return snapshots
+
+    def close(self):
+        self._executor.shutdown(wait=True)
+        self._db.close()
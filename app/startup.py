@@ -0,0 +1,52 @@
+import collections
+import os
+import time
+
+
+def process_age():
+    """Seconds since this process was started, or 0.0 without /proc."""
+    try:
+        with open('/proc/self/stat') as f:
+            # The command name can contain spaces; fields resume after its ')'.
+            fields = f.read().rpartition(')')[2].split()
+        with open('/proc/uptime') as f:
+            uptime = float(f.read().split()[0])
+    except (OSError, ValueError, IndexError):
+        return 0.0
+
+    return max(uptime - int(fields[19]) / os.sysconf('SC_CLK_TCK'), 0.0)
+
+
+class StartupPhases:
+    """Times startup as consecutive phases, counted from process start.
+
+    `mark()` closes the phase running since the previous mark. Work that is
+    started in the background once the bot is connected is timed on its own
+    with `track()`.
+    """
+
+    def __init__(self):
+        self.started = time.monotonic() - process_age()
+        self._last = self.started
+        self.phases = collections.OrderedDict()
+        self.background = collections.OrderedDict()
+
+    def mark(self, name: str):
+        now = time.monotonic()
+        self.phases[name] = now - self._last
+        self._last = now
+
+    async def track(self, name: str, awaitable):
+        started = time.monotonic()
+        try:
+            return await awaitable
+        finally:
+            self.background[name] = time.monotonic() - started
+
+    @property
+    def total(self):
+        return self._last - self.started
+
+    def report(self, background: bool = False):
+        phases = self.background if background else self.phases
+        return ', '.join('{} {:.2f}s'.format(name, seconds) for name, seconds in phases.items())
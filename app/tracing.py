@@ -0,0 +1,173 @@
+import collections
+import contextlib
+import contextvars
+import json
+import os
+import random
+import threading
+import time
+
+from metrics import Histogram
+
+
+STAGE_SECONDS = Histogram(
+    'krulcifer_play_stage_seconds', 'Time spent in each stage of sampled @play requests.',
+    buckets=(0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0), labels=('stage',))
+
+# The trace of the request the running task works on, if it was sampled.
+_current = contextvars.ContextVar('trace', default=None)
+_untraced = contextlib.nullcontext()
+
+
+def current():
+    return _current.get()
+
+
+def span(name: str):
+    """Times the enclosed block as a span of the current trace, if any."""
+    trace = _current.get()
+    return trace.span(name) if trace is not None else _untraced
+
+
+@contextlib.contextmanager
+def use(trace: 'Trace'):
+    """Makes `trace` current for the enclosed block, e.g. in the player task."""
+    token = _current.set(trace)
+    try:
+        yield trace
+    finally:
+        _current.reset(token)
+
+
+class Trace:
+    """Spans of one request, as `(name, start, end)` perf_counter times.
+
+    A trace follows a request across tasks and onto the player thread, so
+    `begin()` and `end()` may be called from different places.
+    """
+
+    __slots__ = ('tracer', 'id', 'name', 'started', 'wall', 'spans', 'error', 'finished', '_open')
+
+    def __init__(self, tracer: 'Tracer', trace_id: int, name: str):
+        self.tracer = tracer
+        self.id = trace_id
+        self.name = name
+        self.started = time.perf_counter()
+        self.wall = time.time()
+        self.spans = []
+        self.error = None
+        self.finished = False
+        self._open = {}
+
+    @contextlib.contextmanager
+    def span(self, name: str):
+        start = time.perf_counter()
+        try:
+            yield self
+        finally:
+            self.spans.append((name, start, time.perf_counter()))
+
+    def begin(self, name: str):
+        self._open[name] = time.perf_counter()
+
+    def end(self, name: str):
+        start = self._open.pop(name, None)
+        if start is not None:
+            self.spans.append((name, start, time.perf_counter()))
+
+    def finish(self, error: str = None):
+        """Closes the trace; must run on the event loop."""
+        if not self.finished:
+            self.finished = True
+            self.error = error
+            self.tracer.finish(self)
+
+
+class Tracer:
+    """Samples requests for tracing, keeps recent span durations per stage
+    for percentiles and appends finished traces to `path`.
+
+    Traces are written as JSON lines, or with `format='chrome'` as a trace
+    event array that chrome://tracing and Perfetto open directly.
+    """
+
+    def __init__(self, *, sample_rate: float = 0.05, path: str = None, format: str = 'jsonl', window: int = 1000):
+        if format not in ('jsonl', 'chrome'):
+            raise ValueError('format must be "jsonl" or "chrome", not {!r}'.format(format))
+
+        self.sample_rate = sample_rate
+        self.path = path
+        self.format = format
+        self.durations = collections.defaultdict(lambda: collections.deque(maxlen=window))
+
+        self.started = 0
+        self.finished = 0
+        self.failed = 0
+
+        self._file = None
+        self._lock = threading.Lock()
+
+    def start(self, name: str, trace_id: int):
+        """Starts a trace for a sampled request and returns None for the
+        others, so unsampled requests cost one random(). Make it current
+        for the request's own code with `use()`."""
+        if self.sample_rate <= 0 or random.random() >= self.sample_rate:
+            return None
+
+        self.started += 1
+        return Trace(self, trace_id, name)
+
+    def finish(self, trace: Trace):
+        self.finished += 1
+        if trace.error is not None:
+            self.failed += 1
+
+        for name, start, end in trace.spans:
+            self.durations[name].append(end - start)
+            STAGE_SECONDS.observe(end - start, stage=name)
+        if trace.error is None:
+            total = max((end for _, _, end in trace.spans), default=trace.started) - trace.started
+            self.durations['total'].append(total)
+            STAGE_SECONDS.observe(total, stage='total')
+
+        if self.path:
+            self._write(trace)
+
+    def _write(self, trace: Trace):
+        if self.format == 'chrome':
+            lines = [json.dumps({
+                'name': name, 'cat': trace.name, 'ph': 'X', 'pid': os.getpid(), 'tid': trace.id,
+                'ts': round(start * 1e6), 'dur': round((end - start) * 1e6),
+                'args': {'error': trace.error} if trace.error else {},
+            }) + ',\n' for name, start, end in trace.spans]
+        else:
+            lines = [json.dumps({
+                'id': trace.id, 'name': trace.name, 'time': trace.wall, 'error': trace.error,
+                'spans': [{'name': name, 'start': start - trace.started, 'duration': end - start}
+                          for name, start, end in trace.spans],
+            }) + '\n']
+
+        with self._lock:
+            if self._file is None:
+                self._file = open(self.path, 'a', buffering=1)
+                if self.format == 'chrome' and not self._file.tell():
+                    # The JSON array format doesn't need the closing bracket.
+                    self._file.write('[\n')
+            self._file.writelines(lines)
+
+    def percentiles(self, quantiles=(0.5, 0.9, 0.99)):
+        """Returns `{stage: (samples, [seconds per quantile])}`."""
+        results = {}
+        for name, durations in list(self.durations.items()):
+            values = sorted(durations)
+            if values:
+                results[name] = (len(values), [values[min(int(q * len(values)), len(values) - 1)]
+                                               for q in quantiles])
+
+        return results
+
+    def close(self):
+        with self._lock:
+            if self._file is not None:
+                self._file.close()
+                self._file = None
@@ -0,0 +1,328 @@
+import asyncio
+import concurrent.futures
+import json
+import os
+import re
+import sqlite3
+import sys
+import threading
+import time
+from collections import OrderedDict
+from urllib.parse import parse_qs, urlparse
+
+
+# Fields youtube_dl returns that we never read back but that make up most of
+# the size of a processed info dict.
+BULKY_FIELDS = (
+    'formats',
+    'requested_formats',
+    'thumbnails',
+    'automatic_captions',
+    'subtitles',
+    'requested_subtitles',
+)
+
+_URL_RE = re.compile(r'^[a-z][a-z0-9+.-]*://', re.IGNORECASE)
+
+
+def normalize_query(query: str):
+    query = query.strip()
+    if _URL_RE.match(query):
+        return query
+
+    return ' '.join(query.casefold().split())
+
+
+def stream_expiry(stream_url: str, ttl: float, now: float):
+    """Signed googlevideo URLs carry their own `expire=` timestamp; trust it
+    over the configured TTL when it is sooner."""
+    expires = now + ttl
+    try:
+        expire = parse_qs(urlparse(stream_url).query).get('expire')
+        if expire:
+            expires = min(expires, float(expire[0]) - 60)
+    except ValueError:
+        pass
+
+    return expires
+
+
+class CacheEntry:
+    __slots__ = ('info', 'stored_at', 'stream_expires')
+
+    def __init__(self, info: dict, stored_at: float, stream_expires: float):
+        self.info = info
+        self.stored_at = stored_at
+        self.stream_expires = stream_expires
+
+    @property
+    def fresh(self):
+        return time.time() < self.stream_expires
+
+
+def _logged(future):
+    # Disk writes are fire and forget; a failure costs a cold entry later.
+    if not future.cancelled() and future.exception() is not None:
+        print('Metadata cache write failed: {!r}'.format(future.exception()), file=sys.stderr)
+
+
+class MetadataCache:
+    """Two-layer cache of resolved youtube_dl info dicts.
+
+    Entries are keyed by `webpage_url`; search strings are stored as aliases
+    pointing at a webpage URL. The metadata and the signed stream URL expire
+    independently, so a stale stream only costs the second extraction pass.
+
+    The sqlite layer is only touched from one thread of its own: memory
+    misses await it there and writes are queued to it without waiting.
+    """
+
+    def __init__(self, maxsize: int = 512, ttl: float = 24 * 3600, stream_ttl: float = 3600,
+                 path: str = None, disk_maxsize: int = 50000):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.stream_ttl = stream_ttl
+        self.disk_maxsize = disk_maxsize
+
+        self._entries = OrderedDict()
+        self._aliases = OrderedDict()
+        self._lock = threading.Lock()
+
+        self.hits = 0
+        self.stale = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+        self.disk_hits = 0
+
+        self._db = None
+        self._executor = None
+        self._disk_writes = 0
+        if path:
+            self._open(path)
+
+    def _open(self, path: str):
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+
+        self._db = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self._db.execute('PRAGMA journal_mode=WAL')
+        self._db.execute('PRAGMA synchronous=NORMAL')
+        self._db.execute('CREATE TABLE IF NOT EXISTS tracks ('
+                         'url TEXT PRIMARY KEY, info TEXT NOT NULL, stored_at REAL NOT NULL, '
+                         'stream_expires REAL NOT NULL, accessed_at REAL NOT NULL)')
+        self._db.execute('CREATE TABLE IF NOT EXISTS aliases ('
+                         'query TEXT PRIMARY KEY, url TEXT NOT NULL, stored_at REAL NOT NULL)')
+        self._db.execute('CREATE INDEX IF NOT EXISTS tracks_accessed ON tracks (accessed_at)')
+
+        self._executor = concurrent.futures.ThreadPoolExecutor(1, thread_name_prefix='metadata-cache')
+
+    def __len__(self):
+        return len(self._entries)
+
+    async def get(self, key: str):
+        """Returns a `CacheEntry` for a search string or webpage URL, or None.
+
+        The entry may hold an expired stream URL; check `entry.fresh`.
+        """
+        now = time.time()
+        query = normalize_query(key)
+        with self._lock:
+            alias = self._aliases.get(query)
+            if alias is not None:
+                self._aliases.move_to_end(query)
+            url = alias[0] if alias is not None else key
+            entry = self._entries.get(url)
+            if entry is not None:
+                self._entries.move_to_end(url)
+
+        if entry is None and self._db is not None:
+            # Without a known alias the query may still have one on disk.
+            alias, url, entry = await asyncio.get_event_loop().run_in_executor(
+                self._executor, self._load, None if alias is not None else query, url, now)
+            with self._lock:
+                if alias is not None:
+                    self._remember(query, *alias)
+                if entry is not None:
+                    self.disk_hits += 1
+                    self._entries[url] = entry
+                    self._trim()
+
+        with self._lock:
+            if entry is not None and now - entry.stored_at > self.ttl:
+                self._drop(url)
+                self.expirations += 1
+                entry = None
+
+            if entry is None:
+                self.misses += 1
+            elif now < entry.stream_expires:
+                self.hits += 1
+            else:
+                self.stale += 1
+
+            return entry
+
+    def put(self, info: dict, *aliases: str):
+        url = info.get('webpage_url')
+        if not url:
+            return
+
+        info = {key: value for key, value in info.items() if key not in BULKY_FIELDS}
+        now = time.time()
+        entry = CacheEntry(info, now, stream_expiry(info.get('url') or '', self.stream_ttl, now))
+        queries = [normalize_query(alias) for alias in aliases]
+
+        with self._lock:
+            self._entries[url] = entry
+            self._entries.move_to_end(url)
+            for query in queries:
+                self._remember(query, url, now)
+            self._trim()
+
+        if self._db is not None:
+            self._executor.submit(self._store, url, json.dumps(info), entry, queries, now).add_done_callback(_logged)
+
+    def alias(self, query: str, url: str):
+        now = time.time()
+        query = normalize_query(query)
+        with self._lock:
+            self._remember(query, url, now)
+
+        if self._db is not None:
+            self._executor.submit(self._db.execute, 'INSERT OR REPLACE INTO aliases VALUES (?, ?, ?)',
+                                  (query, url, now)).add_done_callback(_logged)
+
+    def infos(self):
+        """Every stored info dict, read from disk when the cache is persisted.
+
+        Blocks on the disk; call it from an executor.
+        """
+        if self._db is None:
+            with self._lock:
+                return [entry.info for entry in self._entries.values()]
+
+        rows = self._executor.submit(lambda: self._db.execute('SELECT info FROM tracks').fetchall()).result()
+        return [json.loads(info) for info, in rows]
+
+    def invalidate(self, key: str):
+        query = normalize_query(key)
+        with self._lock:
+            alias = self._aliases.get(query)
+            self._drop(alias[0] if alias is not None else key)
+
+    def stats(self):
+        lookups = self.hits + self.stale + self.misses
+        return {
+            'size': len(self._entries),
+            'hits': self.hits,
+            'stale': self.stale,
+            'misses': self.misses,
+            'evictions': self.evictions,
+            'expirations': self.expirations,
+            'disk_hits': self.disk_hits,
+            'hit_ratio': (self.hits + self.stale) / lookups if lookups else 0.0,
+        }
+
+    def close(self):
+        if self._executor is not None:
+            self._executor.shutdown(wait=True)
+            self._db.close()
+
+    def _remember(self, query: str, url: str, stored_at: float):
+        self._aliases[query] = (url, stored_at)
+        self._aliases.move_to_end(query)
+        while len(self._aliases) > self.maxsize * 2:
+            self._aliases.popitem(last=False)
+
+    def _trim(self):
+        while len(self._entries) > self.maxsize:
+            self._entries.popitem(last=False)
+            self.evictions += 1
+
+    def _drop(self, url: str):
+        self._entries.pop(url, None)
+        if self._db is not None:
+            self._executor.submit(self._db.execute, 'DELETE FROM tracks WHERE url = ?',
+                                  (url,)).add_done_callback(_logged)
+
+    # The methods below run on the cache's own thread.
+
+    def _load(self, query, url: str, now: float):
+        """Returns `(alias, url, entry)`; `alias` is `(url, stored_at)` if
+        `query` was given and found, `entry` is None if `url` isn't stored."""
+        alias = None
+        if query is not None:
+            row = self._db.execute('SELECT url, stored_at FROM aliases WHERE query = ?', (query,)).fetchone()
+            if row is not None and now - row[1] <= self.ttl:
+                alias = (row[0], row[1])
+                url = row[0]
+
+        row = self._db.execute('SELECT info, stored_at, stream_expires FROM tracks WHERE url = ?',
+                               (url,)).fetchone()
+        if row is None:
+            return alias, url, None
+
+        self._db.execute('UPDATE tracks SET accessed_at = ? WHERE url = ?', (now, url))
+        return alias, url, CacheEntry(json.loads(row[0]), row[1], row[2])
+
+    def _store(self, url: str, info: str, entry: CacheEntry, queries: list, now: float):
+        self._db.execute('INSERT OR REPLACE INTO tracks VALUES (?, ?, ?, ?, ?)',
+                         (url, info, entry.stored_at, entry.stream_expires, now))
+        self._db.executemany('INSERT OR REPLACE INTO aliases VALUES (?, ?, ?)',
+                             [(query, url, now) for query in queries])
+
+        self._disk_writes += 1
+        if self._disk_writes % 64:
+            return
+
+        count = self._db.execute('SELECT COUNT(*) FROM tracks').fetchone()[0]
+        if count > self.disk_maxsize:
+            self._db.execute('DELETE FROM tracks WHERE url IN '
+                             '(SELECT url FROM tracks ORDER BY accessed_at LIMIT ?)',
+                             (count - self.disk_maxsize,))
+            self._db.execute('DELETE FROM aliases WHERE url NOT IN (SELECT url FROM tracks)')
+            with self._lock:
+                self.evictions += count - self.disk_maxsize
+
+
+class SingleFlight:
+    """Coalesces concurrent calls for the same key into one.
+
+    The first caller starts the work; everyone asking for the same key
+    while it runs awaits the same future. A caller that is cancelled
+    doesn't cancel the work for the others.
+    """
+
+    def __init__(self):
+        self._pending = {}
+
+        self.calls = 0
+        self.shared = 0
+
+    async def run(self, key, func, *args, **kwargs):
+        self.calls += 1
+        future = self._pending.get(key)
+        if future is not None:
+            self.shared += 1
+        else:
+            future = self._pending[key] = asyncio.ensure_future(func(*args, **kwargs))
+            future.add_done_callback(lambda done: self._finished(key, done))
+
+        return await asyncio.shield(future)
+
+    def _finished(self, key, future: asyncio.Future):
+        if self._pending.get(key) is future:
+            del self._pending[key]
+        if not future.cancelled():
+            # Retrieved here so a failure nobody waited for isn't logged.
+            future.exception()
+
+    def stats(self):
+        return {
+            'in_flight': len(self._pending),
+            'calls': self.calls,
+            'shared': self.shared,
+            'dedupe_ratio': self.shared / self.calls if self.calls else 0.0,
+        }